@@ -0,0 +1,191 @@
+'''Benchmarks of oracle construction, classical checking and simulation
+
+Run e.g.
+
+    python benchmark.py --save baseline.json
+    python benchmark.py --compare baseline.json
+
+where the latter exits with status 1 if some result regressed.'''
+import argparse
+import json
+import platform
+import sys
+import time
+import numpy as np
+import qiskit as qk
+from circuits import *
+from expected import *
+from classical import *
+from grover import *
+from resources import known_dmat
+from execution import select_backend
+from solver import solve_dist_check
+
+# Instances of simulation.ipynb as 
+# (num_nodes, edges, pairs_known, n_iterations)
+INSTANCES = {
+    'A': (3, [(0, 2), (1, 2)], [(0, 1)], 2),
+    'B': (4, [(0, 3), (1, 2), (1, 3), (2, 3)], [(0, 1), (0, 2), (1, 2)],
+        6),
+    'C': (5, [(0, 3), (0, 4), (1, 2), (1, 4), (2, 3)],
+        [(0, 1), (0, 2), (0, 3), (1, 2), (1, 3), (2, 3)], 13),
+    'D': (5, [(0, 4), (1, 4), (2, 4), (3, 4)],
+        [(0, 1), (0, 2), (0, 3), (1, 2), (1, 3), (2, 3)], 25),
+}
+
+# Metrics for which larger values are better, and timed metrics
+HIGHER_IS_BETTER = ['candidates_per_second']
+TIMED = ['build_time', 'transpile_time', 'simulate_time',
+    'candidates_per_second']
+
+def best_time(fun, repeat):
+    '''Smallest wall time of repeat calls of fun(), and its result'''
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        out = fun()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, out
+
+def instance_dmat(name):
+    '''Distance matrix of an instance with only the known pairs'''
+    n, edges, pairs_known, _ = INSTANCES[name]
+    dmat = dmat_expected(edges, n)
+    known = np.full((n, n), False)
+    for j, k in pairs_known:
+        known[j, k] = known[k, j] = True
+    return np.where(known, dmat, np.inf)
+
+def bench_oracle(dmat, grouped, repeat=1, num_cands=2**16):
+    '''Construction time, transpiled size and depth and classical
+        check throughput of the oracle for known distances dmat'''
+    ix, ds = dmat2ds(dmat)
+    ds_groups = dmat2ds_groups(dmat)
+    def build():
+        circuit_cache.clear()
+        if grouped:
+            return Dist_check_groups(ds_groups)
+        return Dist_check(ix, ds)
+    build_time, qc = best_time(build, repeat)
+    transpile_time, compiled = best_time(lambda: qk.transpile(qc,
+        basis_gates=['cx', 'u'], optimization_level=0), 1)
+    rng = np.random.default_rng(0)
+    edges = pack_candidates(rng.random((num_cands, ix.num_edges)) < 0.5)
+    if grouped:
+        check = lambda: c_dist_check_groups_batch(edges, ds_groups)
+    else:
+        check = lambda: c_dist_check_batch(edges, ix, ds)
+    check_time, _ = best_time(check, repeat)
+    return {'num_qubits': qc.num_qubits, 'build_time': build_time,
+        'transpile_time': transpile_time, 'size': compiled.size(),
+        'depth': compiled.depth(),
+        'candidates_per_second': num_cands/check_time}
+
+def bench_instance(name, fix_edges, repeat=1, shots=1000):
+    '''Time of simulating Grover's algorithm on an instance of
+        simulation.ipynb with the notebook's number of iterations,
+        or with the optimal number for the known number of solutions
+        when the edges determined by the distances are fixed.
+        For comparison with the number of oracle calls, n_steps,
+        include the number of search nodes of the classical solver.'''
+    _, _, _, n_steps = INSTANCES[name]
+    ix, ds = dmat2ds(instance_dmat(name))
+    fixed = dist_check_fixed_edges(ix, ds) if fix_edges else {}
+    num_unknown = ix.num_edges - len(fixed)
+    if fix_edges:
+        sols = c_dist_check_solutions(ix, ds, fixed)
+        n_steps = grover_n_steps(num_unknown, len(sols))
+    circuit_cache.clear()
+    oracle = Bitflip2Phaseflip(Dist_check(ix, ds, fixed))
+    qc = GroverCircuits(oracle, range(num_unknown)).circuit(n_steps)
+    backend = select_backend(qc)
+    compiled = qk.transpile(qc, backend)
+    simulate_time, _ = best_time(lambda: backend.run(compiled,
+        shots=shots).result(), repeat)
+    solver_nodes = solve_dist_check(ix, ds, fixed, 
+        list_solutions=False)['nodes_explored']
+    return {'num_qubits': qc.num_qubits, 'n_steps': n_steps,
+        'method': backend.options.method, 'simulate_time': simulate_time,
+        'solver_nodes': solver_nodes}
+
+def run_benchmarks(ns=(4, 5, 6), densities=(0.5, 1.0),
+        instances=('A', 'B', 'C', 'D'), full=False, repeat=3, seed=0):
+    '''Run the benchmarks and return them as a dictionary with the
+        results indexed by case names. The random graphs have n nodes
+        for n in ns and known pairs with given densities. The instances
+        are simulated with fixed edges, and also without when full.'''
+    rng = np.random.default_rng(seed)
+    results = {}
+    for n in ns:
+        imat = np.triu(rng.random((n, n)) < 0.5, 1)
+        dmat = dmat_expected(imat | imat.T)
+        for density in densities:
+            dmat_known = known_dmat(dmat, density, rng)
+            if len(dmat2ds(dmat_known)[1]) == 0:
+                continue
+            for grouped in [False, True]:
+                key = f'oracle/n={n}/density={density}/grouped={grouped}'
+                results[key] = bench_oracle(dmat_known, grouped, repeat)
+    for name in instances:
+        for fix_edges in [True, False] if full else [True]:
+            key = f'grover/{name}/fixed={fix_edges}'
+            results[key] = bench_instance(name, fix_edges, repeat)
+    return {'meta': {'python': platform.python_version(),
+        'qiskit': qk.__version__, 'machine': platform.machine(),
+        'numpy': np.__version__}, 'results': results}
+
+def compare(baseline, current, tolerance=1.5):
+    '''Compare the results of run_benchmarks with a baseline
+        Return a list of regressions as dictionaries. Timings regress
+        when they are worse by more than the factor tolerance, and
+        the other numeric results regress when they are worse.'''
+    regressions = []
+    for key, base in baseline['results'].items():
+        if key not in current['results']:
+            continue
+        for metric, old in base.items():
+            new = current['results'][key].get(metric)
+            if isinstance(old, str) or new is None:
+                continue
+            if metric in HIGHER_IS_BETTER:
+                old, new = new, old
+            factor = tolerance if metric in TIMED else 1
+            if new > factor*old:
+                regressions.append({'case': key, 'metric': metric,
+                    'baseline': base[metric],
+                    'current': current['results'][key][metric]})
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--save', help='save the results as JSON')
+    parser.add_argument('--compare', help='baseline JSON to compare to')
+    parser.add_argument('--tolerance', type=float, default=1.5,
+        help='allowed slowdown factor of timings')
+    parser.add_argument('--ns', type=int, nargs='+', default=[4, 5, 6])
+    parser.add_argument('--densities', type=float, nargs='+',
+        default=[0.5, 1.0])
+    parser.add_argument('--instances', nargs='*',
+        default=['A', 'B', 'C', 'D'])
+    parser.add_argument('--full', action='store_true',
+        help='also simulate the instances without fixed edges')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args(argv)
+    current = run_benchmarks(args.ns, args.densities, args.instances,
+        args.full, args.repeat)
+    for key, result in current['results'].items():
+        print(key, result)
+    if args.save is not None:
+        with open(args.save, 'w') as f:
+            json.dump(current, f, indent=1)
+    if args.compare is not None:
+        with open(args.compare) as f:
+            regressions = compare(json.load(f), current, args.tolerance)
+        for regression in regressions:
+            print('REGRESSION', regression)
+        return 1 if regressions else 0
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,41 +1,332 @@
+import functools
+import hashlib
+import os
+from collections import OrderedDict
 import numpy as np
+import qiskit
+from qiskit import qpy
 from qiskit import QuantumRegister as QReg
 from qiskit import QuantumCircuit as QCirc
-from qiskit.circuit.library import AND, OR
+from qiskit.circuit.library import AND, OR, DiagonalGate
+from profiling import profiler
 
 class QCircH(QCirc):
-    '''Helper class for defining quantum circuits'''
-    def __init__(self, qc):
-        super().__init__(*qc.qregs)
-        self.compose(qc, qubits=qc.qubits, inplace=True)
+    '''Helper class for defining quantum circuits
+        Given a single circuit, its instructions are copied, and
+        otherwise the circuit starts empty with the given registers.'''
+    def __init__(self, *regs):
+        if len(regs) == 1 and isinstance(regs[0], QCirc):
+            qc, = regs
+            super().__init__(*qc.qregs)
+            self.compose(qc, qubits=qc.qubits, inplace=True)
+        else:
+            super().__init__(*regs)
 
     def find_reg(self, name):
         '''Find the named quantum register'''
         return [reg for reg in self.qregs if reg.name == name][0]
 
+    def reg_size(self, name):
+        '''Size of the named quantum register, or 0 if not found'''
+        return sum([reg.size for reg in self.qregs if reg.name == name])
+
+class CircuitCache():
+    '''Least recently used cache of constructed circuits
+        When cache_dir is given, the circuits are also saved there 
+        in QPY format and loaded on later cache misses, also 
+        in other processes. The cached circuits must not be modified.'''
+    def __init__(self, maxsize=64, cache_dir=None):
+        self.maxsize = maxsize
+        self.cache_dir = cache_dir
+        self.circuits = OrderedDict()
+
+    def path(self, key):
+        '''File name of the QPY file for given key'''
+        digest = hashlib.sha256(
+            repr((qiskit.__version__, key)).encode()).hexdigest()
+        return os.path.join(self.cache_dir, f'{key[0]}-{digest}.qpy')
+
+    def get(self, key, build):
+        '''Return the circuit with given key, calling build() 
+            to construct it if it is not found'''
+        if key in self.circuits:
+            self.circuits.move_to_end(key)
+            return self.circuits[key]
+        if self.cache_dir is None:
+            qc = self.build(key, build)
+        else:
+            path = self.path(key)
+            if os.path.exists(path):
+                with profiler.phase('load', circuit=key[0]):
+                    with open(path, 'rb') as f:
+                        qc = QCircH(qpy.load(f)[0])
+            else:
+                qc = self.build(key, build)
+                os.makedirs(self.cache_dir, exist_ok=True)
+                tmp = f'{path}.{os.getpid()}.tmp'
+                with open(tmp, 'wb') as f:
+                    qpy.dump(qc, f)
+                os.replace(tmp, path)
+        self.circuits[key] = qc
+        while len(self.circuits) > self.maxsize:
+            self.circuits.popitem(last=False)
+        return qc
+
+    def build(self, key, build):
+        '''Call build() recording the phase in profiler'''
+        with profiler.phase('build', circuit=key[0]) as record:
+            qc = build()
+            profiler.circuit(record, qc)
+        return qc
+
+    def clear(self):
+        '''Empty the in-process cache'''
+        self.circuits.clear()
+
+circuit_cache = CircuitCache()
+
+def indexing_key(ix):
+    '''Hashable description of PathIndexing'''
+    return (ix.num_nodes, tuple(ix.perm), ix.num_levels)
+
+def fixed_key(fixed):
+    '''Hashable description of fixed edges'''
+    if fixed is None:
+        return ()
+    return tuple(sorted((int(i), bool(v)) for i, v in fixed.items()))
+
+def needed_key(needed):
+    '''Hashable description of needed paths'''
+    if needed is None:
+        return None
+    return tuple(np.flatnonzero(needed).tolist())
+
+def paths_circuit(ix, num_d_steps, fixed=None, needed=None, 
+        decompose=None):
+    '''Cached version of Paths(ix, num_d_steps, fixed, needed, 
+        decompose)'''
+    key = ('Paths', indexing_key(ix), num_d_steps, fixed_key(fixed),
+        needed_key(needed), decompose)
+    return circuit_cache.get(key, 
+        lambda: Paths(ix, num_d_steps, fixed, needed, decompose))
+
+def dist_check_circuit(ix, ds, fixed=None, decompose=None):
+    '''Cached version of Dist_check(ix, ds, fixed, decompose)'''
+    key = ('Dist_check', indexing_key(ix), 
+        tuple((int(i), int(d)) for i, d in ds), fixed_key(fixed),
+        decompose)
+    return circuit_cache.get(key, 
+        lambda: Dist_check(ix, ds, fixed, decompose))
+
+def dist_check_groups_circuit(ds_groups, fixed=None, decompose=None):
+    '''Cached version of Dist_check_groups(ds_groups, fixed, 
+        decompose)'''
+    key = ('Dist_check_groups', tuple((indexing_key(ix), 
+        tuple((int(i), int(d)) for i, d in ds)) 
+        for ix, ds in ds_groups), fixed_key(fixed), decompose)
+    return circuit_cache.get(key, 
+        lambda: Dist_check_groups(ds_groups, fixed, decompose))
+
+# Decomposition of the wide OR and AND gates
+#
+# With decompose=None the wide gates are appended as the library 
+# gates OR and AND. With decompose='qubits' they are built as balanced
+# trees of Toffolis on workspace qubits that are known to be zero
+# at that point, and the inputs left over when these run out go to
+# a narrower library gate. With decompose='depth' the register tree 
+# is added so that every wide gate becomes a full tree of 
+# logarithmic depth.
+
+def check_decompose(decompose):
+    '''Raise ValueError for an unknown decomposition strategy'''
+    if decompose not in [None, 'qubits', 'depth']:
+        raise ValueError(f'Unknown decomposition {decompose}')
+
+def tree_size(widths, decompose):
+    '''Size of the register tree given pairs (width, num_idle) of 
+        the wide gates, where num_idle is the number of zero 
+        workspace qubits available to the gate'''
+    if decompose != 'depth':
+        return 0
+    return max([width - 2 - num_idle for width, num_idle in widths] 
+        + [0])
+
+@functools.lru_cache(maxsize=None)
+def and_gate(num_ins, flags=None):
+    '''Library AND gate, shared by all its uses with the same 
+        width and tuple of flags'''
+    return AND(num_ins, flags=None if flags is None 
+        else list(flags)).to_gate()
+
+@functools.lru_cache(maxsize=None)
+def or_gate(num_ins):
+    '''Library OR gate, shared by all its uses with the same width'''
+    return OR(num_ins).to_gate()
+
+# Gates of the oracles that are their own inverses
+SELF_INVERSE = ['x', 'cx', 'ccx', 'rccx', 'mcx', 'and', 'or']
+
+def emit(qc, source, qubits, inverse=False):
+    '''Append the instructions of the circuit source to qc, where
+        qubits lists the qubits of qc taking the places of 
+        source.qubits. With inverse=True the instructions are 
+        appended in reverse order and inverted, which for the gates
+        in SELF_INVERSE leaves them as they are. Unlike appending
+        source.to_gate(), this copies neither source nor its gates.'''
+    qubit_map = dict(zip(source.qubits, qubits))
+    data = reversed(source.data) if inverse else source.data
+    for instruction in data:
+        op = instruction.operation
+        if inverse and op.name not in SELF_INVERSE:
+            op = op.inverse()
+        qc.append(op, [qubit_map[q] for q in instruction.qubits],
+            copy=False)
+
+def append_and(qc, ins, out, flags=None, idle=(), decompose=None):
+    '''Append a gate flipping out iff the inputs ins, negated where 
+        flags is -1 as in the library AND, are all True. Unless 
+        decompose is None, the gate is a balanced tree of Toffolis 
+        on the zero qubits idle. The Toffolis computing the tree are
+        relative-phase Toffolis, whose phases cancel when the tree 
+        is uncomputed.'''
+    if decompose is None:
+        flags = None if flags is None else tuple(flags)
+        qc.append(and_gate(len(ins), flags), ins + [out])
+        return
+    negated = [q for q, flag in zip(ins, flags or []) if flag == -1]
+    for q in negated:
+        qc.x(q)
+    queue, idle, triples = list(ins), list(idle), []
+    while len(queue) > 2 and len(idle) > 0:
+        triple = (queue.pop(0), queue.pop(0), idle.pop(0))
+        qc.rccx(*triple) # compute tree
+        triples.append(triple)
+        queue.append(triple[2])
+    if len(queue) == 1:
+        qc.cx(queue[0], out)
+    elif len(queue) == 2:
+        qc.ccx(queue[0], queue[1], out)
+    else:
+        qc.append(and_gate(len(queue)), queue + [out])
+    for triple in reversed(triples):
+        qc.rccx(*triple) # uncompute tree
+    for q in negated:
+        qc.x(q)
+
+def append_or(qc, ins, out, idle=(), decompose=None):
+    '''Append a gate flipping out iff some of the inputs ins are True,
+        decomposed as in append_and'''
+    if decompose is None:
+        qc.append(or_gate(len(ins)), ins + [out])
+        return
+    append_and(qc, ins, out, [-1]*len(ins), idle, decompose)
+    qc.x(out)
+
 class Paths(QCircH):
     '''When viewed as a Boolean function returns paths given edges
         where paths has True at ix.path(d, j, k) iff 
-        there is a path of length <= d+2 between nodes j and k'''
-    def __init__(self, ix, num_d_steps):        
-        edges = QReg(ix.num_edges, 'edges')
-        paths = QReg(num_d_steps*ix.num_paths_per_d, 'paths')
+        there is a path of length <= d+2 between nodes j and k
+        The edges with indices in the dictionary fixed are hard-wired
+        to the given Boolean values, and the register edges holds 
+        only the remaining edges in increasing order.
+        When the boolean array needed is given, only the paths with 
+        needed[d, i] True are computed, and the register paths holds
+        only them in the order of ix.path.
+        The ORs are decomposed as described by decompose, see 
+        append_and, using the paths not yet computed as zero qubits.
+        This assumes that the register paths is initially zero.'''
+    def __init__(self, ix, num_d_steps, fixed=None, needed=None, 
+            decompose=None):        
+        check_decompose(decompose)
+        if fixed is None:
+            fixed = {}
+        if needed is None:
+            needed = np.full((num_d_steps, ix.num_paths_per_d), True)
+        edges = QReg(ix.num_edges - len(fixed), 'edges')
+        paths = QReg(int(needed.sum()), 'paths')
         ancs  = QReg(ix.num_nodes-2, 'ancs')
-        qc = QCirc(edges, paths, ancs)
+        evars = edges_vars(edges, ix.num_edges, fixed)
+        pvars = paths_vars(paths, needed)
 
+        steps = []
         for d in range(num_d_steps):
             for i in range(ix.num_paths_per_d):
+                if not needed[d, i]:
+                    continue
                 pairs, single, out = paths_test1_vars(
-                    edges, paths, ix, d, i)          
-                triples = list(zip(pairs, ancs))
-                for (control1, control2), anc in triples: 
-                    qc.ccx(control1, control2, anc) # compute and
-                qc.append(OR(len(triples)+1).to_gate(), 
-                    ancs[:] + [single, out])
-                for (control1, control2), anc in triples: 
-                    qc.ccx(control1, control2, anc) # uncompute and
+                    evars, pvars, ix, d, i)          
+                steps.append((out, *fold_test1_constants(pairs, single)))
+        # The kth step computes paths[k], and the later paths are zero
+        tree = QReg(tree_size([(len(pairs) + len(singles), 
+            ancs.size - len(pairs) + paths.size - k - 1)
+            for k, (_, pairs, singles) in enumerate(steps)
+            if singles is not True], decompose), 'tree')
+        super().__init__(edges, paths, ancs, *([tree] if tree.size else []))
+        qc = self
 
-        super().__init__(qc)
+        for k, (out, pairs, singles) in enumerate(steps):
+            if singles is True:
+                qc.x(out)
+                continue
+            triples = list(zip(pairs, ancs))
+            for (control1, control2), anc in triples: 
+                qc.ccx(control1, control2, anc) # compute and
+            ins = ancs[:len(triples)] + singles
+            if len(ins) > 0:
+                append_or(qc, ins, out, ancs[len(triples):] 
+                    + paths[k+1:] + tree[:], decompose)
+            for (control1, control2), anc in triples: 
+                qc.ccx(control1, control2, anc) # uncompute and
+
+def edges_vars(edges, num_edges, fixed):
+    '''List the edge variables where the edges in fixed are 
+        constants and the rest are taken from edges in order'''
+    unknown = iter(edges)
+    return [bool(fixed[i]) if i in fixed else next(unknown) 
+        for i in range(num_edges)]
+
+def paths_vars(paths, needed):
+    '''List the path variables in the order of ix.path, 
+        with None for the paths that are not needed'''
+    pvars = [None]*needed.size
+    for qubit, ind in zip(paths, np.flatnonzero(needed)):
+        pvars[ind] = qubit
+    return pvars
+
+def paths_cone(ix, ds, num_d_steps):
+    '''Boolean array with True at [d, i] iff the path with index 
+        d*ix.num_paths_per_d + i is needed to check the distances ds, 
+        either directly in Test 2 or through Test 1'''
+    needed = np.full((num_d_steps, ix.num_paths_per_d), False)
+    for i, d in ds:
+        needed[:d-1, i] = True
+    for d in range(num_d_steps - 1, 0, -1):
+        js, _ = ix.to_edges(np.flatnonzero(needed[d]))
+        for j in np.unique(js):
+            ps = ix.nodes_complement([j])
+            needed[d-1, ix.edges(np.full(len(ps), j), ps)] = True
+    return needed
+
+def fold_test1_constants(pairs, single):
+    '''Simplify the variables of Test 1 when some of them are 
+        constants. Return the pairs of variables to be ANDed and 
+        the list of single variables to be ORed, or True instead 
+        of the list if Test 1 passes regardless of the variables.'''
+    if single is True:
+        return [], True
+    singles = [] if single is False else [single]
+    ands = []
+    for pair in pairs:
+        if any(v is False for v in pair):
+            continue
+        live = [v for v in pair if v is not True]
+        if len(live) == 0:
+            return [], True
+        elif len(live) == 1:
+            singles.append(live[0])
+        else:
+            ands.append(pair)
+    return ands, singles
 
 def paths_test1_vars(edges, paths, ix, d, i):
     '''Setup variables to perform Test 1 using ANDs and ORs'''
@@ -56,27 +347,81 @@ class Dist_check(QCircH):
     '''When viewed as a Boolean function returns out given edges
         where out is True iff the graph has the given distances.
         Here ds = [(i0, d0), (i1, d1), ...] and d0 is the distance 
-        between nodes j and k where i0 = ix.edge(j, k).'''
-    def __init__(self, ix, ds):
+        between nodes j and k where i0 = ix.edge(j, k).
+        The edges in the dictionary fixed are hard-wired as in Paths.
+        The wide gates are decomposed as described by decompose,
+        see append_and.'''
+    def __init__(self, ix, ds, fixed=None, decompose=None):
+        check_decompose(decompose)
+        if fixed is None:
+            fixed = {}
         flags = dist_check_test2_flags(ix, ds)
         num_d_steps = flags.shape[0] - 1
         flags = flags.flatten().tolist()
 
-        edges = QReg(ix.num_edges, 'edges')
-        paths = QReg(num_d_steps*ix.num_paths_per_d, 'paths')
+        needed = paths_cone(ix, ds, num_d_steps)
+
+        edges = QReg(ix.num_edges - len(fixed), 'edges')
+        paths = QReg(int(needed.sum()), 'paths')
         ancs  = QReg(ix.num_nodes-2, 'ancs')
+        evars = edges_vars(edges, ix.num_edges, fixed)
+        pvars = paths_vars(paths, needed)
+        vals, flags = fold_test2_constants(
+            evars[:ix.num_paths_per_d] + pvars, flags)
+
+        paths_qc = paths_circuit(ix, num_d_steps, fixed, needed, 
+            decompose)
+        widths = [] if isinstance(flags, bool) else [(len(vals), ancs.size)]
+        tree = QReg(max(paths_qc.reg_size('tree'), 
+            tree_size(widths, decompose)), 'tree')
         out   = QReg(1, 'out')
-        qc = QCirc(edges, paths, ancs, out)
+        super().__init__(edges, paths, ancs, 
+            *([tree] if tree.size else []), out)
+        qc = self
 
-        qc.append(Paths(ix, num_d_steps).to_gate(), 
-            edges[:] + paths[:] + ancs[:]) # compute paths
-        vals = edges[:ix.num_paths_per_d] + paths[:]
-        qc.append(AND(len(vals), flags=flags).to_gate(),
-            vals + out[:])
-        qc.append(Paths(ix, num_d_steps).to_gate().inverse(), 
-            edges[:] + paths[:] + ancs[:]) # uncompute paths
+        paths_qubits = (edges[:] + paths[:] + ancs[:] 
+            + tree[:paths_qc.reg_size('tree')])
+        with profiler.phase('emit', circuit='Paths'):
+            emit(qc, paths_qc, paths_qubits) # compute paths
+        if flags is True:
+            qc.x(out)
+        elif flags is not False:
+            append_and(qc, vals, out[0], flags, ancs[:] + tree[:], 
+                decompose)
+        with profiler.phase('emit', circuit='Paths'):
+            emit(qc, paths_qc, paths_qubits, inverse=True) # uncompute
 
-        super().__init__(qc)
+def fold_test2_constants(vals, flags):
+    '''Simplify the variables of Test 2 when some of them are 
+        constants. Return the variables and flags to be used in AND,
+        or True or False instead of the flags if Test 2 passes or 
+        fails regardless of the variables.'''
+    out_vals, out_flags = [], []
+    for val, flag in zip(vals, flags):
+        if flag == 0:
+            continue
+        if val is True or val is False:
+            if val != (flag == 1):
+                return [], False
+        else:
+            out_vals.append(val)
+            out_flags.append(flag)
+    if len(out_vals) == 0:
+        return [], True
+    return out_vals, out_flags
+
+def dist_check_fixed_edges(ix, ds):
+    '''Edges determined by the distances, as a dictionary suitable
+        for Dist_check. Distance 1 forces an edge to be present 
+        and distance >= 2 forces it to be absent.'''
+    flags = dist_check_test2_flags(ix, ds)
+    return {int(i): bool(flags[0, i] == 1) 
+        for i in np.flatnonzero(flags[0])}
+
+def dist_check_paths_size(ix, ds):
+    '''Size of the register paths in Dist_check(ix, ds)'''
+    num_d_steps = max([d for _, d in ds]) - 1
+    return int(paths_cone(ix, ds, num_d_steps).sum())
 
 def dist_check_test2_flags(ix, ds):
     '''Compute the flags needed to perform Test 2 
@@ -104,36 +449,70 @@ class Dist_check_groups(QCircH):
 
         The grouping can be used to control the trade-off between 
         the number of qubits and the size of the circuit.
+        The wide gates are decomposed as described by decompose,
+        see append_and.
         '''
-    def __init__(self, ds_groups):
-        paths_size = max([d*ix.num_paths_per_d 
-            for ix, ds in ds_groups for _, d in ds])
+    def __init__(self, ds_groups, fixed=None, decompose=None):
+        check_decompose(decompose)
+        if fixed is None:
+            fixed = {}
+        paths_size = max([dist_check_paths_size(ix, ds) 
+            for ix, ds in ds_groups])
         ix, _ = ds_groups[0]
+        dist_checks = []
+        for group, (ix, ds) in enumerate(ds_groups):
+            with profiler.phase('group', group=group, 
+                    num_ds=len(ds)) as record:
+                dist_checks.append(dist_check_circuit(ix, ds, 
+                    group_fixed_edges(ix, fixed), decompose))
+                profiler.circuit(record, dist_checks[-1])
 
-        edges = QReg(ix.num_edges, 'edges')
+        edges = QReg(ix.num_edges - len(fixed), 'edges')
         paths = QReg(paths_size, 'paths')
         ancs1 = QReg(ix.num_nodes-2, 'ancs1')
         ancs2 = QReg(len(ds_groups), 'ancs2')
+        tree = QReg(max([dist_check.reg_size('tree') 
+            for dist_check in dist_checks] + [tree_size([(len(ds_groups),
+            paths.size + ancs1.size)], decompose)]), 'tree')
         out   = QReg(1, 'out')
-        qc = QCirc(edges, paths, ancs1, ancs2, out)
+        super().__init__(edges, paths, ancs1, ancs2, 
+            *([tree] if tree.size else []), out)
+        qc = self
+        evars = edges_vars(edges, ix.num_edges, fixed)
 
-        triples = list(zip(ds_groups, ancs2))
-        for (ix, ds), anc2 in triples: 
-            dist_check = Dist_check(ix, ds)
-            paths_size = dist_check.find_reg('paths').size
-            qc.append(dist_check.to_gate(),
-                edges[ix.edge_permutation] + paths[:paths_size] 
-                + ancs1[:] + [anc2]) # compute dist_check
-        qc.append(AND(len(ds_groups)).to_gate(),
-            ancs2[:] + out[:])
-        for (ix, ds), anc2 in reversed(triples): 
-            dist_check = Dist_check(ix, ds)
+        blocks = []
+        for (ix, ds), dist_check, anc2 in zip(ds_groups, dist_checks, 
+                ancs2): 
             paths_size = dist_check.find_reg('paths').size
-            qc.append(dist_check.to_gate().inverse(),
-                edges[ix.edge_permutation] + paths[:paths_size] 
-                + ancs1[:] + [anc2]) # uncompute dist_check
-        
-        super().__init__(qc)
+            qubits = (group_edges(ix, evars) + paths[:paths_size] 
+                + ancs1[:] + tree[:dist_check.reg_size('tree')] + [anc2])
+            with profiler.phase('emit', circuit='Dist_check'):
+                emit(qc, dist_check, qubits) # compute dist_check
+            blocks.append((dist_check, qubits))
+        append_and(qc, ancs2[:], out[0], idle=paths[:] + ancs1[:] 
+            + tree[:], decompose=decompose)
+        for dist_check, qubits in reversed(blocks): 
+            with profiler.phase('emit', circuit='Dist_check'):
+                emit(qc, dist_check, qubits, inverse=True) # uncompute
+
+def group_fixed_edges(ix, fixed):
+    '''Translate fixed edges to the indexing of a group'''
+    return {i: fixed[j] for i, j in enumerate(ix.edge_permutation) 
+        if j in fixed}
+
+def group_edges(ix, evars):
+    '''Edge qubits of a group in the order of its indexing'''
+    return [evars[j] for j in ix.edge_permutation 
+        if not isinstance(evars[j], bool)]
+
+def dist_check_groups_fixed_edges(ds_groups):
+    '''Edges determined by the grouped distances, as a dictionary 
+        suitable for Dist_check_groups'''
+    fixed = {}
+    for ix, ds in ds_groups:
+        for i, val in dist_check_fixed_edges(ix, ds).items():
+            fixed[ix.edge_permutation[i]] = val
+    return fixed
 
 class Bitflip2Phaseflip(QCircH):
     '''Turn a bit flip oracle into a phase flip oracle'''
@@ -147,3 +526,71 @@ class Bitflip2Phaseflip(QCircH):
         qc.h(out)
         qc.x(out)              
         super().__init__(qc)
+
+class Table_check(QCircH):
+    '''When viewed as a Boolean function returns out given edges
+        where out is True iff the integer with bits edges is in sols.
+        With sols given by c_dist_check_solutions, this is equivalent
+        to Dist_check but does not need the paths and ancs registers.'''
+    def __init__(self, num_edges, sols):
+        edges = QReg(num_edges, 'edges')
+        out   = QReg(1, 'out')
+        qc = QCirc(edges, out)
+        def mark():
+            if num_edges == 0:
+                qc.x(out)
+            else:
+                qc.mcx(edges[:], out[0])
+        mark_table(qc, edges, sols, mark)
+        super().__init__(qc)
+
+class Table_phase(QCircH):
+    '''Phase flip oracle that flips the phase of edges iff
+        the integer with bits edges is in sols
+        The phase flips are implemented either by multi-controlled 
+        Z gates, method='mcz', or by a diagonal gate, 
+        method='diagonal'.'''
+    def __init__(self, num_edges, sols, method='mcz'):
+        edges = QReg(num_edges, 'edges')
+        qc = QCirc(edges)
+        if method not in ['mcz', 'diagonal']:
+            raise ValueError(f'Unknown method {method}')
+        if method == 'diagonal' and num_edges > 0:
+            diag = np.ones(2**num_edges)
+            diag[list(sols)] = -1
+            qc.append(DiagonalGate(diag.tolist()), edges[:])
+        else:
+            def mark():
+                if num_edges == 0:
+                    qc.global_phase += np.pi
+                elif num_edges == 1:
+                    qc.z(edges[0])
+                else:
+                    qc.mcp(np.pi, edges[:-1], edges[-1])
+            mark_table(qc, edges, sols, mark)
+        super().__init__(qc)
+
+def gray_rank(g):
+    '''Position of the integer g in the Gray code order'''
+    b = 0
+    while g:
+        b ^= g
+        g >>= 1
+    return b
+
+def mark_table(qc, edges, sols, mark):
+    '''Call mark() to append a gate controlled by edges being all 
+        ones, conjugated by X gates so that it acts on the integers 
+        in sols. The solutions are visited in Gray code order, and 
+        the X gates between consecutive solutions are merged.'''
+    flipped = 0
+    for sol in sorted(sols, key=gray_rank):
+        target = ~sol & (2**len(edges) - 1)
+        for k in range(len(edges)):
+            if (flipped ^ target) >> k & 1:
+                qc.x(edges[k])
+        flipped = target
+        mark()
+    for k in range(len(edges)):
+        if flipped >> k & 1:
+            qc.x(edges[k])
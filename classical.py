@@ -1,9 +1,11 @@
 import numpy as np
 from circuits import *
 
-def c_paths(edges, ix, num_d_steps):
+def c_paths_test1(edges, ix, num_d_steps):
     '''Return a boolean vector with True at ix.path(d, j, k) iff 
-        there is a path of length <= d+2 between nodes j and k'''
+        there is a path of length <= d+2 between nodes j and k
+        This reference implementation performs Test 1 pair by pair 
+        exactly as the quantum circuit Paths does.'''
     paths = np.full(num_d_steps*ix.num_paths_per_d, False) 
     for d in range(num_d_steps):
         for i in range(ix.num_paths_per_d):
@@ -18,22 +20,75 @@ def c_paths(edges, ix, num_d_steps):
                 paths[ind] = not paths[ind]
     return paths
 
+def edges2packed(edges, ix):
+    '''Convert indexed edges to the incidence matrix 
+        stored as rows of bits packed in uint64 words'''
+    n = ix.num_nodes
+    js, ks = ix.edge_table
+    sel = np.flatnonzero(edges)
+    imat = np.zeros((n, -(-n // 64)*64), dtype=bool)
+    imat[js[sel], ks[sel]] = True
+    imat[ks[sel], js[sel]] = True
+    return np.packbits(imat, axis=1, bitorder='little').view('<u8')
+
+def packed_reach(adj, sources, num_d_steps, chunk_words=2**24):
+    '''Yield for d = 0, ..., num_d_steps - 1 the packed rows R where 
+        the bit k of R[i] is set iff there is a path of length <= d+2 
+        between nodes sources[i] and k, with the bit sources[i] unset.
+        Each step is a boolean matrix product of the newly reached
+        nodes (the frontier) and the incidence matrix adj.'''
+    num_words = adj.shape[1]
+    rows = np.arange(len(sources))
+    diag_words = sources // 64
+    diag_bits = np.uint64(1) << (sources % 64).astype(np.uint64)
+    reach = adj[sources].copy()
+    frontier = reach.copy()
+    chunk = max(1, chunk_words // (adj.shape[0]*num_words))
+    for _ in range(num_d_steps):
+        if frontier.any():
+            new = np.zeros_like(reach)
+            for c in range(0, len(sources), chunk):
+                bits = np.unpackbits(frontier[c:c+chunk].view(np.uint8),
+                    axis=1, bitorder='little')[:, :adj.shape[0]]
+                fj, fp = np.nonzero(bits)
+                if len(fj) == 0:
+                    continue
+                starts = np.flatnonzero(np.r_[True, fj[1:] != fj[:-1]])
+                new[c + fj[starts]] = np.bitwise_or.reduceat(
+                    adj[fp], starts, axis=0)
+            new[rows, diag_words] &= ~diag_bits
+            frontier = new & ~reach
+            reach |= frontier
+        yield reach
+
+def c_paths(edges, ix, num_d_steps):
+    '''Return a boolean vector with True at ix.path(d, j, k) iff 
+        there is a path of length <= d+2 between nodes j and k
+        The result equals that of c_paths_test1 but is computed 
+        with packed boolean matrix products.'''
+    paths = np.full(num_d_steps*ix.num_paths_per_d, False)
+    adj = edges2packed(edges, ix)
+    sources = ix.perm_array[:ix.num_levels]
+    js, ks = ix.edge_table
+    js, ks = js[:ix.num_paths_per_d], ks[:ix.num_paths_per_d]
+    rows = ix.inv_perm[js]
+    reach = packed_reach(adj, sources, num_d_steps)
+    for d, r in enumerate(reach):
+        bits = (r[rows, ks // 64] >> (ks % 64).astype(np.uint64)) & 1
+        paths[d*ix.num_paths_per_d:(d+1)*ix.num_paths_per_d] = bits
+    return paths
+
 def c_dist_check(edges, ix, ds):
     '''Check if the graph has the given distances
         Here ds = [(i0, d0), (i1, d1), ...] and d0 is the distance 
         between nodes j and k where i0 = ix.edge(j, k).'''
-    out = True
     flags = dist_check_test2_flags(ix, ds)
     num_d_steps = flags.shape[0] - 1
     flags = flags.flatten()
     paths = c_paths(edges, ix, num_d_steps)
-    vals = list(edges[range(ix.num_paths_per_d)]) + list(paths)
-    for i in range(len(vals)):
-        if flags[i] == 1:
-            out = out and vals[i]
-        elif flags[i] == -1:
-            out = out and not vals[i]
-    return out
+    vals = np.concatenate((edges[:ix.num_paths_per_d], paths))
+    return bool(np.all(vals[flags == 1]) 
+        and not np.any(vals[flags == -1]))
 
 def c_dist_check_groups(edges, ds_groups):
     '''Check if the graph has the given distances        
@@ -47,3 +102,157 @@ def c_dist_check_groups(edges, ds_groups):
         out = out and c_dist_check(
             edges[ix.edge_permutation], ix, ds)
     return out
+
+# Bit-sliced batch evaluation
+#
+# A block of candidate edge vectors is stored as a uint64 array of
+# shape (num_edges, num_words), where bit b of word w in row i is
+# the value of edge i for the candidate 64*w + b in the block.
+# A candidate given as an integer c has edge i equal to bit i of c,
+# so that format(c, f'0{num_edges}b') is the bit string measured
+# by Qiskit.
+
+WORD_BITS = 64
+ONES = np.uint64(2**64 - 1)
+# Bit patterns of edges 0, ..., 5 in a block of consecutive candidates
+LOW_PATTERNS = [np.uint64(sum(1 << b for b in range(64) if b >> i & 1))
+    for i in range(6)]
+
+def pack_candidates(cands):
+    '''Pack a boolean matrix with one candidate edge vector per row
+        to the bit-sliced form'''
+    cands = np.asarray(cands, dtype=bool)
+    num_words = -(-cands.shape[0] // WORD_BITS)
+    bits = np.zeros((cands.shape[1], num_words*WORD_BITS), dtype=bool)
+    bits[:, :cands.shape[0]] = cands.T
+    return np.packbits(bits, axis=1, bitorder='little').view('<u8')
+
+def unpack_candidates(words, num_cands):
+    '''Inverse of pack_candidates for a vector of words,
+        returns the boolean vector of length num_cands'''
+    bits = np.unpackbits(np.ascontiguousarray(words, dtype='<u8')
+        .view(np.uint8), bitorder='little')
+    return bits[:num_cands].astype(bool)
+
+def candidate_block(num_edges, start, num_words):
+    '''Bit-sliced block of the candidates start, start+1, ...
+        Here start must be a multiple of 64.'''
+    words = (start // WORD_BITS 
+        + np.arange(num_words, dtype=np.uint64))
+    block = np.empty((num_edges, num_words), dtype=np.uint64)
+    for i in range(num_edges):
+        if i < 6:
+            block[i] = LOW_PATTERNS[i]
+        else:
+            block[i] = np.where((words >> np.uint64(i - 6)) 
+                & np.uint64(1), ONES, np.uint64(0))
+    return block
+
+def candidate_blocks(num_edges, block_words=1024):
+    '''Yield (start, count, block) covering all 2**num_edges 
+        candidates in chunks of block_words words'''
+    total = 2**num_edges
+    step = block_words*WORD_BITS
+    for start in range(0, total, step):
+        count = min(step, total - start)
+        num_words = -(-count // WORD_BITS)
+        yield start, count, candidate_block(num_edges, start, num_words)
+
+def c_paths_batch(edges, ix, num_d_steps):
+    '''Bit-sliced version of c_paths'''
+    paths = np.zeros((num_d_steps*ix.num_paths_per_d, edges.shape[1]),
+        dtype=np.uint64)
+    for d in range(num_d_steps):
+        for i in range(ix.num_paths_per_d):
+            pairs, single, out = paths_test1_vars(
+                edges, paths, ix, d, i)
+            acc = single.copy()
+            for elem1, elem2 in pairs:
+                acc |= elem1 & elem2
+            out ^= acc
+    return paths
+
+def c_dist_check_batch(edges, ix, ds):
+    '''Bit-sliced version of c_dist_check, 
+        returns the words with bits set for passing candidates'''
+    flags = dist_check_test2_flags(ix, ds)
+    num_d_steps = flags.shape[0] - 1
+    flags = flags.flatten()
+    paths = c_paths_batch(edges, ix, num_d_steps)
+    out = np.full(edges.shape[1], ONES)
+    for i in np.flatnonzero(flags):
+        if i < ix.num_paths_per_d:
+            val = edges[i]
+        else:
+            val = paths[i - ix.num_paths_per_d]
+        if flags[i] == 1:
+            out &= val
+        else:
+            out &= ~val
+    return out
+
+def c_dist_check_groups_batch(edges, ds_groups):
+    '''Bit-sliced version of c_dist_check_groups'''
+    out = np.full(edges.shape[1], ONES)
+    for ix, ds in ds_groups:
+        out &= c_dist_check_batch(edges[ix.edge_permutation], ix, ds)
+    return out
+
+def expand_packed(block, fixed, num_edges):
+    '''Insert the edges in the dictionary fixed as constant rows 
+        to a bit-sliced block of the remaining edges'''
+    out = np.empty((num_edges, block.shape[1]), dtype=np.uint64)
+    unknown = [i for i in range(num_edges) if i not in fixed]
+    out[unknown] = block
+    for i, val in fixed.items():
+        out[i] = ONES if val else 0
+    return out
+
+def c_solutions(fun, num_edges, *args, fixed=None, block_words=1024):
+    '''Return the candidates, as integers, for which the bit-sliced
+        function fun(edges, *args) passes, by going through
+        all 2**num_edges candidates
+        When the dictionary fixed is given, only the edges not in it
+        are enumerated and the integers encode these edges.'''
+    if fixed is None:
+        fixed = {}
+    num_unknown = num_edges - len(fixed)
+    sols = []
+    for start, count, block in candidate_blocks(num_unknown, 
+            block_words):
+        block = expand_packed(block, fixed, num_edges)
+        passes = unpack_candidates(fun(block, *args), count)
+        sols.extend((start + np.flatnonzero(passes)).tolist())
+    return sols
+
+def c_dist_check_solutions(ix, ds, fixed=None, block_words=1024):
+    '''All edge vectors, as integers, having the given distances'''
+    return c_solutions(c_dist_check_batch, ix.num_edges, ix, ds, 
+        fixed=fixed, block_words=block_words)
+
+def c_dist_check_groups_solutions(ds_groups, fixed=None, 
+        block_words=1024):
+    '''All edge vectors, as integers, having the grouped distances'''
+    ix, _ = ds_groups[0]
+    return c_solutions(c_dist_check_groups_batch, ix.num_edges, 
+        ds_groups, fixed=fixed, block_words=block_words)
+
+def table_dist_check(ix, ds, fixed=None, phase=False, method='mcz'):
+    '''Tabulate the solutions of the distance check classically 
+        and return the equivalent Table_check, or Table_phase when 
+        phase is True, acting only on the unknown edges'''
+    num_edges = ix.num_edges - (0 if fixed is None else len(fixed))
+    sols = c_dist_check_solutions(ix, ds, fixed=fixed)
+    if phase:
+        return Table_phase(num_edges, sols, method)
+    return Table_check(num_edges, sols)
+
+def table_dist_check_groups(ds_groups, fixed=None, phase=False, 
+        method='mcz'):
+    '''Grouped version of table_dist_check'''
+    ix, _ = ds_groups[0]
+    num_edges = ix.num_edges - (0 if fixed is None else len(fixed))
+    sols = c_dist_check_groups_solutions(ds_groups, fixed=fixed)
+    if phase:
+        return Table_phase(num_edges, sols, method)
+    return Table_check(num_edges, sols)
@@ -0,0 +1,174 @@
+import os
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from qiskit.circuit import ControlledGate
+import qiskit as qk
+import qiskit_aer
+from profiling import profiler
+
+# Gates that map basis states to basis states up to a phase
+DIAGONAL_GATES = ['z', 's', 'sdg', 't', 'tdg', 'p', 'rz', 'u1', 'cz',
+    'cp', 'ccz', 'mcp', 'mcphase', 'diagonal']
+CLIFFORD_GATES = ['x', 'y', 'z', 'h', 's', 'sdg', 'sx', 'sxdg', 'cx',
+    'cy', 'cz', 'swap', 'id']
+
+def default_backend():
+    '''Backend used when none is given'''
+    return qiskit_aer.AerSimulator(method='statevector')
+
+def run_chunk(circuits, backend, shots):
+    '''Run a list of circuits as one job and return their counts'''
+    if backend is None:
+        backend = default_backend()
+    with profiler.phase('simulate', num_circuits=len(circuits), 
+            shots=shots, method=backend.options.method):
+        result = backend.run(circuits, shots=shots).result()
+    return [result.get_counts(i) for i in range(len(circuits))]
+
+def run_circuits(circuits, shots=1000, backend=None, chunk_size=64,
+        max_workers=1):
+    '''Run transpiled circuits in jobs of chunk_size circuits,
+        spread over max_workers processes when max_workers > 1
+        Yield pairs (index, counts) as the jobs complete.'''
+    chunks = [(start, circuits[start:start+chunk_size])
+        for start in range(0, len(circuits), chunk_size)]
+    if max_workers == 1:
+        for start, chunk in chunks:
+            for i, counts in enumerate(run_chunk(chunk, backend, shots)):
+                yield start + i, counts
+        return
+    # Forking a process that has run Aer threads can deadlock
+    context = mp.get_context('spawn')
+    with ProcessPoolExecutor(max_workers, mp_context=context) as pool:
+        futures = {pool.submit(run_chunk, chunk, backend, shots): start
+            for start, chunk in chunks}
+        for future in as_completed(futures):
+            for i, counts in enumerate(future.result()):
+                yield futures[future] + i, counts
+
+def transpile_in_place(circuits, backend):
+    '''Transpile the list of circuits, all on the same number of
+        qubits, for backend keeping each qubit on the physical qubit
+        with the same index, so that the results can be composed and
+        their qubits found by index. Raise ValueError if routing
+        permutes the qubits.'''
+    num_qubits = circuits[0].num_qubits
+    # Without a coupling map the layout is trivial, and fixing it
+    # would widen the circuits to all qubits of the backend
+    if backend.coupling_map is None:
+        compiled = qk.transpile(circuits, backend)
+    else:
+        compiled = qk.transpile(circuits, backend,
+            initial_layout=list(range(num_qubits)))
+    for qc in compiled:
+        if qc.layout is None:
+            continue
+        if (qc.layout.final_layout is not None
+                or qc.layout.initial_index_layout()[:num_qubits]
+                != list(range(num_qubits))):
+            raise ValueError('Backend permutes the qubits')
+    return compiled
+
+def basis_circuits(circuit, init_regs_list, backend=None):
+    '''Circuits running circuit on basis states, where the named
+        registers are initialized with given Boolean vectors as in
+        test_circuits.run_circuit. The circuit is transpiled once
+        by transpile_in_place and only the X gates preparing the
+        inputs vary. Here init_regs_list = [init_regs0, ...].'''
+    if backend is None:
+        backend = default_backend()
+    with profiler.phase('transpile') as record:
+        [compiled] = transpile_in_place([circuit], backend)
+        profiler.circuit(record, compiled)
+    circuits = []
+    for init_regs in init_regs_list:
+        qc = qk.QuantumCircuit(compiled.num_qubits)
+        for name, vec in init_regs:
+            reg = circuit.find_reg(name)
+            for qubit, value in zip(reg, vec):
+                if value:
+                    qc.x(circuit.find_bit(qubit).index)
+        qc.compose(compiled, inplace=True)
+        qc.measure_all()
+        circuits.append(qc)
+    return circuits
+
+def run_basis_states(circuit, init_regs_list, backend=None,
+        chunk_size=64, max_workers=1):
+    '''Run circuit once on each of the basis states given as in
+        basis_circuits. Yield pairs (index, outb) as the jobs
+        complete, where outb is the measured bit string of the
+        qubits of circuit with the qubit 0 first.'''
+    circuits = basis_circuits(circuit, init_regs_list, backend)
+    for i, counts in run_circuits(circuits, 1, backend, chunk_size,
+            max_workers):
+        yield i, list(counts.keys())[0][::-1][:circuit.num_qubits]
+
+def circuit_structure(qc):
+    '''Find the qubits acted on by gates creating superpositions
+        and whether the circuit consists of Clifford gates only'''
+    superposed = set()
+    clifford = True
+    def walk(qc, qubits):
+        nonlocal clifford
+        for instruction in qc.data:
+            op = instruction.operation
+            inds = [qubits[qc.find_bit(q).index]
+                for q in instruction.qubits]
+            if op.name in ['barrier', 'measure', 'reset']:
+                continue
+            controlled_x = (isinstance(op, ControlledGate)
+                and op.base_gate.name == 'x')
+            if op.name not in CLIFFORD_GATES and (controlled_x
+                    or op.name in DIAGONAL_GATES or op.definition is None):
+                clifford = False
+            if controlled_x or op.name in ['x'] + DIAGONAL_GATES:
+                continue
+            elif op.definition is not None and op.name != 'h':
+                walk(op.definition, inds)
+            else:
+                superposed.update(inds)
+    walk(qc, list(range(qc.num_qubits)))
+    return superposed, clifford
+
+def estimate_memory(qc, precision='double'):
+    '''Estimate the memory in bytes needed by the Aer simulation
+        methods for qc. The bond dimension of the matrix product state
+        is bounded by 2**r, where r is the number of qubits acted on by
+        gates creating superpositions, since the other qubits hold
+        functions of these qubits when the workspace is uncomputed
+        as in the oracles here.'''
+    n = qc.num_qubits
+    amplitude = 16 if precision == 'double' else 8
+    superposed, clifford = circuit_structure(qc)
+    bond = 2**min(len(superposed), n // 2)
+    out = {'num_qubits': n, 'num_superposed': len(superposed),
+        'statevector': amplitude*2**n,
+        'matrix_product_state': amplitude*2*n*bond**2}
+    if clifford:
+        out['stabilizer'] = n*(2*n + 1)//4 + 1
+    return out
+
+def available_memory():
+    '''Available physical memory in bytes, or None if unknown'''
+    try:
+        return os.sysconf('SC_PAGE_SIZE')*os.sysconf('SC_AVPHYS_PAGES')
+    except (ValueError, OSError, AttributeError):
+        return None
+
+def select_backend(qc, memory_limit=None, precision='double'):
+    '''Choose the Aer simulation method needing the least memory
+        for qc. Raise MemoryError if no method fits in memory_limit
+        bytes, which defaults to the available memory.'''
+    if memory_limit is None:
+        memory_limit = available_memory()
+    estimates = estimate_memory(qc, precision)
+    methods = ['stabilizer', 'matrix_product_state', 'statevector']
+    mems = {method: estimates[method] for method in methods
+        if method in estimates}
+    method = min(mems, key=lambda method: mems[method])
+    if memory_limit is not None and mems[method] > memory_limit:
+        raise MemoryError(f'Simulating {qc.num_qubits} qubits needs '
+            f'{mems[method]/2**30:.3g} GiB using {method}, '
+            f'but only {memory_limit/2**30:.3g} GiB is available')
+    return qiskit_aer.AerSimulator(method=method, precision=precision)
@@ -2,43 +2,131 @@ import numpy as np
 from scipy import sparse as spr
 import indexing as ind
 
+def graph2csr(graph, num_nodes=None):
+    '''Convert a graph to a sparse adjacency matrix. The graph is
+        a dense or sparse incidence matrix, or a list of edges (j, k)
+        in which case num_nodes must be given.'''
+    if spr.issparse(graph):
+        return spr.csr_matrix(graph)
+    if isinstance(graph, np.ndarray):
+        return spr.csr_matrix(graph)
+    edges = np.asarray(graph, dtype=np.int64).reshape(-1, 2)
+    return spr.csr_matrix((np.full(len(edges), True), 
+        (edges[:, 0], edges[:, 1])), shape=(num_nodes, num_nodes))
+
 def imat2edges(ix, imat):
-    '''Convert incidence matrix to indexed edges'''
+    '''Convert incidence matrix to indexed edges
+        The incidence matrix can also be sparse or a list of edges.'''
     edges = np.full(ix.num_edges, False)
-    for i in range(ix.num_edges):
-        edges[i] = imat[ix.to_edge(i)]
+    if isinstance(imat, np.ndarray):
+        js, ks = ix.edge_table
+        edges[:] = imat[js, ks]
+        return edges
+    coo = graph2csr(imat, ix.num_nodes).tocoo()
+    mask = (coo.row != coo.col) & (coo.data != 0)
+    edges[ix.edges(coo.row[mask], coo.col[mask])] = True
     return edges
 
-def dmat_expected(imat):
-    '''Compute distances as a matrix using scipy'''
-    return spr.csgraph.dijkstra(spr.csr_matrix(imat), 
+def dmat_expected(imat, num_nodes=None):
+    '''Compute distances as a matrix using scipy
+        The incidence matrix can also be sparse or a list of edges.'''
+    return spr.csgraph.dijkstra(graph2csr(imat, num_nodes), 
         directed=False, unweighted=True)
 
+def known_csr(dmat):
+    '''Symmetrize a sparse distance matrix that stores only the known
+        distances, in either triangle or both. Dense matrices are 
+        returned as they are.'''
+    if not spr.issparse(dmat):
+        return dmat
+    return spr.csr_matrix(dmat.maximum(dmat.T))
+
+def dmat_rows(dmat, start, stop):
+    '''Dense rows start, ..., stop - 1 of a distance matrix with inf
+        for the unknown distances, where a sparse dmat is as given 
+        by known_csr'''
+    if not spr.issparse(dmat):
+        return np.asarray(dmat[start:stop], dtype=float)
+    rows = np.full((stop - start, dmat.shape[1]), np.inf)
+    coo = dmat[start:stop].tocoo()
+    rows[coo.row, coo.col] = coo.data
+    return rows
+
+def iter_ds(dmat, chunk_rows=256):
+    '''Yield the known distances (i, d) of dmat as in dmat2ds, 
+        converting chunk_rows rows at a time'''
+    n, _ = dmat.shape
+    dmat = known_csr(dmat)
+    ix = ind.EdgeIndexing(n)
+    for start in range(0, n, chunk_rows):
+        stop = min(start + chunk_rows, n)
+        rows = dmat_rows(dmat, start, stop)
+        js, ks = np.nonzero(np.triu(rows != np.inf, start + 1))
+        js += start
+        inds = ix.num_edges_below_level(js) + ks - js - 1
+        yield from zip(inds.tolist(), 
+            rows[js - start, ks].astype(int).tolist())
+
+def iter_expected_ds(imat, num_nodes=None, chunk_rows=256):
+    '''Yield the distances (i, d) of a graph as in 
+        dmat2ds(dmat_expected(imat)), computing the distances from
+        chunk_rows nodes at a time'''
+    csr = graph2csr(imat, num_nodes)
+    n, _ = csr.shape
+    ix = ind.EdgeIndexing(n)
+    for start in range(0, n - 1, chunk_rows):
+        stop = min(start + chunk_rows, n - 1)
+        rows = spr.csgraph.dijkstra(csr, directed=False, 
+            unweighted=True, indices=np.arange(start, stop))
+        js, ks = np.nonzero(np.triu(rows != np.inf, start + 1))
+        js += start
+        inds = ix.num_edges_below_level(js) + ks - js - 1
+        yield from zip(inds.tolist(), 
+            rows[js - start, ks].astype(int).tolist())
+
 def dmat2ds(dmat):
     '''Convert distance matrix to the form consumed by 
-        Dist_check'''
+        Dist_check
+        Unknown distances are inf, or missing in a sparse dmat.'''
     n, _ = dmat.shape
     ix = ind.PathIndexing(n)
-    return ix, [(i, int(dmat[ix.to_edge(i)])) 
-        for i in range(ix.num_edges) 
-        if dmat[ix.to_edge(i)] != np.inf]
+    return ix, list(iter_ds(dmat))
 
 def dmat2ds_groups(dmat):
     '''Convert distance matrix to the form consumed by 
         Dist_check_groups with a separate group for each node'''
     n, _ = dmat.shape
     ds_groups = []
-    for o in range(n):
+    for o, (i, d) in groupby_rows(dmat):
         ix = ind.PathIndexing(n, perm=o, num_levels=1)
-        ds = []
-        for k in range(o+1, n):
-            d = dmat[o, k]
-            if d != np.inf:
-                ds.append((ix.edge(o, k), int(d)))
-        if ds != []:
-            ds_groups.append((ix, ds))
+        ds_groups.append((ix, list(zip(
+            ix.edges(np.full(len(i), o), i).tolist(), d.tolist()))))
     return ds_groups
 
+def groupby_rows(dmat, chunk_rows=256):
+    '''Yield (o, (ks, ds)) for the nodes o with known distances ds 
+        to nodes ks > o'''
+    n, _ = dmat.shape
+    dmat = known_csr(dmat)
+    for start in range(0, n, chunk_rows):
+        stop = min(start + chunk_rows, n)
+        rows = dmat_rows(dmat, start, stop)
+        known = np.triu(rows != np.inf, start + 1)
+        for r in np.flatnonzero(known.any(axis=1)):
+            ks = np.flatnonzero(known[r])
+            yield int(start + r), (ks, rows[r, ks].astype(int))
+
+def reduce_edges(edges, fixed):
+    '''Drop the edges in the dictionary fixed from indexed edges'''
+    return np.array([e for i, e in enumerate(edges) if i not in fixed], 
+        dtype=bool)
+
+def expand_edges(edges, fixed, num_edges):
+    '''Inverse of reduce_edges'''
+    unknown = iter(edges)
+    return np.array([fixed[i] if i in fixed else next(unknown) 
+        for i in range(num_edges)], dtype=bool)
+
 def bools2str(bs):
     '''Convert a list of booleans to a bit string'''
     return ''.join([str(int(b)) for b in bs])
@@ -0,0 +1,158 @@
+import numpy as np
+import indexing as ind
+from resources import *
+
+def known_pairs(dmat):
+    '''Pairs (j, k) with j < k of nodes with known distance'''
+    js, ks = np.nonzero(np.triu(dmat != np.inf, 1))
+    return list(zip(js.tolist(), ks.tolist()))
+
+def group_indexing(n, sources):
+    '''Indexing of a group whose paths originate from sources
+        The order of the nodes within sources and within the rest
+        of the nodes does not change the resources of the group.'''
+    perm = list(sources) + [v for v in range(n) if v not in sources]
+    return ind.PathIndexing(n, perm=perm, num_levels=len(sources))
+
+def groups2ds_groups(dmat, groups):
+    '''Convert groups [(sources0, pairs0), (sources1, pairs1), ...]
+        to the form consumed by Dist_check_groups. Here each pair
+        (j, k) in pairs0 must have j or k in sources0.'''
+    n, _ = dmat.shape
+    ds_groups = []
+    for sources, pairs in groups:
+        ix = group_indexing(n, sources)
+        ds = sorted((ix.edge(j, k), int(dmat[j, k])) for j, k in pairs)
+        ds_groups.append((ix, ds))
+    return ds_groups
+
+def cover_pairs(pairs, dmat):
+    '''Assign each pair to one of its nodes, called its source,
+        by greedily choosing the nodes covering most remaining pairs,
+        breaking ties by the largest distance to be checked. Return a
+        dictionary from the sources to their lists of pairs.'''
+    remaining = set(pairs)
+    out = {}
+    while remaining:
+        def score(v):
+            ds = [dmat[p] for p in remaining if v in p]
+            return len(ds), -max(ds, default=0), -v
+        nodes = {v for p in remaining for v in p}
+        v = max(nodes, key=score)
+        out[v] = sorted(p for p in remaining if v in p)
+        remaining.difference_update(out[v])
+    return out
+
+class GroupCosts():
+    '''Cached resources of single groups for the search in
+        optimize_groups'''
+    def __init__(self, dmat, fixed=None):
+        self.dmat = dmat
+        self.fixed = {} if fixed is None else fixed
+        self.costs = {}
+
+    def get(self, sources, pairs):
+        '''Resources of Dist_check for the group'''
+        key = (tuple(sorted(sources)), tuple(sorted(pairs)))
+        if key not in self.costs:
+            [(ix, ds)] = groups2ds_groups(self.dmat, [(key[0], key[1])])
+            self.costs[key] = dist_check_resources(ix, ds,
+                group_fixed_edges(ix, self.fixed))
+        return self.costs[key]
+
+def improve_cover(cover, costs):
+    '''Move pairs between sources, and drop sources left without
+        pairs, while the total number of Toffolis decreases'''
+    def total(cover):
+        return sum(costs.get([v], pairs).toffolis
+            for v, pairs in cover.items() if pairs)
+    best = total(cover)
+    improved = True
+    while improved:
+        improved = False
+        for v, pairs in list(cover.items()):
+            for p in pairs:
+                w = p[0] if p[1] == v else p[1]
+                if w not in cover:
+                    continue
+                trial = dict(cover)
+                trial[v] = [q for q in pairs if q != p]
+                trial[w] = sorted(cover[w] + [p])
+                cost = total(trial)
+                if cost < best:
+                    cover, best, improved = trial, cost, True
+                    break
+            if improved:
+                break
+    return {v: pairs for v, pairs in cover.items() if pairs}
+
+def pack_sources(cover, costs, num_groups):
+    '''Partition the sources into num_groups groups balancing the
+        sizes of the register paths, largest sources first'''
+    sizes = {v: costs.get([v], pairs).qubits for v, pairs in cover.items()}
+    groups = [([], []) for _ in range(num_groups)]
+    loads = [0]*num_groups
+    for v in sorted(cover, key=lambda v: (-sizes[v], v)):
+        g = int(np.argmin(loads))
+        groups[g][0].append(v)
+        groups[g][1].extend(cover[v])
+        loads[g] += sizes[v]
+    return [group for group in groups if group[0]]
+
+def groups_resources(groups, costs):
+    '''Resources of Dist_check_groups for the groups,
+        as in dist_check_groups_resources'''
+    n, _ = costs.dmat.shape
+    m = n*(n - 1)//2 - len(costs.fixed)
+    group_costs = [costs.get(sources, pairs) for sources, pairs in groups]
+    # Dist_check has the registers edges, paths, ancs and out
+    paths_size = max(res.qubits - m - (n - 2) - 1 for res in group_costs)
+    res = Resources(m + paths_size + n - 2 + len(groups) + 1)
+    for group_res in group_costs:
+        res.add(group_res, 2)
+    res.gates[('and', len(groups))] += 1
+    return res
+
+def optimize_groups(dmat, max_qubits=None, max_gates=None,
+        objective='toffolis', fixed=None):
+    '''Search for a grouping of the known distances in dmat for
+        Dist_check_groups that minimizes the objective, 'toffolis',
+        'gates' or 'qubits' as estimated by resources.py, subject to
+        at most max_qubits qubits and max_gates gates. The gates are
+        the Toffolis and the single qubit and CNOT gates, as counted
+        in Resources.num_gates.
+        The search assigns each known pair to one of its nodes,
+        improves the assignment, and packs the resulting sources to
+        each possible number of groups. The grouping of dmat2ds_groups
+        is also considered. Return (ds_groups, resources) or raise
+        ValueError if no grouping found fits in the budget.'''
+    metrics = {'toffolis': lambda res: res.toffolis,
+        'gates': lambda res: res.num_gates, 'qubits': lambda res: res.qubits}
+    if objective not in metrics:
+        raise ValueError(f'Unknown objective {objective}')
+    pairs = known_pairs(dmat)
+    if len(pairs) == 0:
+        raise ValueError('No known distances')
+    costs = GroupCosts(dmat, fixed)
+    cover = improve_cover(cover_pairs(pairs, dmat), costs)
+    candidates = [[([o], [p for p in pairs if p[0] == o])
+        for o in range(dmat.shape[0]) if any(p[0] == o for p in pairs)]]
+    for num_groups in range(1, len(cover) + 1):
+        candidates.append(pack_sources(cover, costs, num_groups))
+    best, best_res, min_qubits = None, None, None
+    for groups in candidates:
+        res = groups_resources(groups, costs)
+        if min_qubits is None or res.qubits < min_qubits:
+            min_qubits = res.qubits
+        if max_qubits is not None and res.qubits > max_qubits:
+            continue
+        if max_gates is not None and res.num_gates > max_gates:
+            continue
+        key = lambda res: (metrics[objective](res), res.toffolis,
+            res.qubits)
+        if best is None or key(res) < key(best_res):
+            best, best_res = groups, res
+    if best is None:
+        raise ValueError('No grouping found within the budget, '
+            f'the fewest qubits found is {min_qubits}')
+    return groups2ds_groups(dmat, best), best_res
@@ -1,48 +1,260 @@
 import numpy as np
 import qiskit as qk
+from profiling import profiler
+from execution import transpile_in_place
 
 def grover(oracle, state, n_steps = -1):
     '''Constuct a quantum circuit that runs n_steps of Grover's 
         algorithm on the qubits given by the indices in state 
         and using the (phase flip) oracle'''
+    return GroverCircuits(oracle, state).circuit(n_steps)
 
-    if n_steps < 0:
-        n_steps = grover_n_steps(len(state))
+def grover_init(num_qubits, state):
+    '''Quantum circuit that prepares the uniform superposition'''
+    qc = qk.QuantumCircuit(num_qubits)
+    for qubit in state: # Initialize
+        qc.h(qubit)
+    return qc
 
+def grover_iteration_circuit(oracle, state):
+    '''Quantum circuit running one step of Grover's algorithm'''
     qc = qk.QuantumCircuit(oracle.num_qubits)
-    for qubit in state: # Initialize
+    qc.append(oracle, range(oracle.num_qubits))
+    # Diffuser steps, for an explanation, see
+    # https://learn.qiskit.org/course/ch-algorithms/grovers-algorithm
+    # 1. Apply transformation |s> -> |00..0> (H-gates)
+    #   where |s> is the uniform superposition
+    for qubit in state:
         qc.h(qubit)
-    for _ in range(n_steps):
-        qc.append(oracle, range(oracle.num_qubits))
-        # Diffuser steps, for an explanation, see
-        # https://learn.qiskit.org/course/ch-algorithms/grovers-algorithm
-        # 1. Apply transformation |s> -> |00..0> (H-gates)
-        #   where |s> is the uniform superposition
-        for qubit in state:
-            qc.h(qubit)
-        # 2. Apply transformation |00..0> -> |11..1> (X-gates)
-        for qubit in state:
-            qc.x(qubit)
-        # 3. Do multi-controlled-Z gate
-        qc.h(state[-1])
-        qc.mct(list(state[:-1]), state[-1])  # multi-controlled-toffoli
-        qc.h(state[-1])
-        # 4. Apply transformation |11..1> -> |00..0>
-        for qubit in state:
-            qc.x(qubit)
-        # 5. Apply transformation |00..0> -> |s>
-        for qubit in state:
-            qc.h(qubit)
-    qc.measure_all()
-    return qc    
-
-def grover_n_steps(n_state_qubits):
+    # 2. Apply transformation |00..0> -> |11..1> (X-gates)
+    for qubit in state:
+        qc.x(qubit)
+    # 3. Do multi-controlled-Z gate
+    qc.h(state[-1])
+    qc.mcx(list(state[:-1]), state[-1])  # multi-controlled-toffoli
+    qc.h(state[-1])
+    # 4. Apply transformation |11..1> -> |00..0>
+    for qubit in state:
+        qc.x(qubit)
+    # 5. Apply transformation |00..0> -> |s>
+    for qubit in state:
+        qc.h(qubit)
+    return qc
+
+class GroverCircuits():
+    '''Circuits running Grover's algorithm for varying numbers of 
+        steps. The initialization and the iteration are built once, 
+        and transpiled once per backend by transpile_in_place, after
+        which circuits for any number of steps are obtained by 
+        composing the blocks.'''
+    def __init__(self, oracle, state):
+        self.state = list(state)
+        self.num_state_qubits = len(self.state)
+        self.blocks = {None: (grover_init(oracle.num_qubits, self.state),
+            grover_iteration_circuit(oracle, self.state))}
+
+    def transpiled_blocks(self, backend):
+        '''Initialization and iteration transpiled for backend'''
+        if backend not in self.blocks:
+            with profiler.phase('transpile') as record:
+                blocks = transpile_in_place(list(self.blocks[None]), 
+                    backend)
+                profiler.circuit(record, blocks[1])
+            self.blocks[backend] = tuple(blocks)
+        return self.blocks[backend]
+
+    def circuit(self, n_steps=-1, backend=None):
+        '''Circuit running n_steps of Grover's algorithm, 
+            transpiled for backend when it is given'''
+        if n_steps < 0:
+            n_steps = grover_n_steps(self.num_state_qubits)
+        init, iteration = self.transpiled_blocks(backend)
+        with profiler.phase('compose', n_steps=n_steps) as record:
+            qc = qk.QuantumCircuit(init.num_qubits)
+            qc.compose(init, inplace=True)
+            for _ in range(n_steps):
+                qc.compose(iteration, inplace=True)
+            qc.measure_all()
+            profiler.circuit(record, qc)
+        return qc
+
+    def sweep(self, n_steps_range, backend=None):
+        '''Yield pairs (n_steps, circuit) for n_steps in the range'''
+        for n_steps in n_steps_range:
+            yield n_steps, self.circuit(n_steps, backend)
+
+def grover_n_steps(n_state_qubits, num_sols=1):
     '''Optimal number of Grover iterations assuming that the 
-        number of solutions is one'''
-    theta = np.arcsin(1/np.sqrt(2**n_state_qubits))
+        number of solutions is num_sols, by default one'''
+    theta = np.arcsin(min(np.sqrt(num_sols)*2.0**(-n_state_qubits/2), 1))
     if theta < np.pi/8:
         return int(np.ceil(np.pi/(4*theta) - 1/2))
     elif theta < np.pi/4:
         return 1
     else: 
-        return 0
\ No newline at end of file
+        return 0
+
+def grover_amplitudes(sols, n_state_qubits, n_steps=-1):
+    '''Amplitudes of the state after n_steps of Grover's algorithm 
+        with the marked states given by the integers in sols
+        The state with integer c corresponds to the bit string 
+        format(c, f'0{n_state_qubits}b') measured by Qiskit.'''
+    if n_steps < 0:
+        n_steps = grover_n_steps(n_state_qubits)
+    sols = np.asarray(sols, dtype=np.int64)
+    amps = np.full(2**n_state_qubits, 1/np.sqrt(2**n_state_qubits))
+    for _ in range(n_steps):
+        grover_iteration(amps, sols)
+    return amps
+
+def grover_iteration(amps, sols):
+    '''Apply the oracle marking sols and the diffuser 
+        to the amplitudes in place'''
+    amps[sols] *= -1
+    mean = amps.mean()
+    amps *= -1
+    amps += 2*mean
+
+def grover_probabilities(sols, n_state_qubits, n_steps=-1, 
+        num_qubits=None):
+    '''Simulate Grover's algorithm without building a circuit
+        Return the probabilities of the outcomes as a dictionary 
+        indexed by bit strings like those of Qiskit Sampler. 
+        When num_qubits is given, the bit strings are padded by 
+        zeros as if all qubits of an oracle were measured.'''
+    probs = grover_amplitudes(sols, n_state_qubits, n_steps)**2
+    if num_qubits is None:
+        num_qubits = n_state_qubits
+    return {format(c, f'0{num_qubits}b'): float(p) 
+        for c, p in enumerate(probs) if p > 0}
+
+def grover_counts(sols, n_state_qubits, n_steps=-1, shots=1000, 
+        seed=None, num_qubits=None):
+    '''Simulate Grover's algorithm without building a circuit
+        Return the counts of shots like those of AerSimulator'''
+    probs = grover_amplitudes(sols, n_state_qubits, n_steps)**2
+    rng = np.random.default_rng(seed)
+    samples = rng.multinomial(shots, probs/probs.sum())
+    if num_qubits is None:
+        num_qubits = n_state_qubits
+    return qk.result.Counts({format(c, f'0{num_qubits}b'): int(s) 
+        for c in np.flatnonzero(samples) for s in [samples[c]]})
+
+def grover_success_probabilities(sols, n_state_qubits, max_steps):
+    '''Probability of measuring a marked state after 
+        n_steps = 0, 1, ..., max_steps Grover iterations'''
+    sols = np.asarray(sols, dtype=np.int64)
+    amps = np.full(2**n_state_qubits, 1/np.sqrt(2**n_state_qubits))
+    out = np.empty(max_steps + 1)
+    for n_steps in range(max_steps + 1):
+        out[n_steps] = np.sum(amps[sols]**2)
+        grover_iteration(amps, sols)
+    return out
+
+# Search with an unknown number of solutions
+#
+# A sampler is a function sample(n_steps, shots) returning the list
+# of the integers measured in shots runs of n_steps of Grover's 
+# algorithm, and verify(c) checks classically whether the integer c
+# is a solution. The searches return a dictionary with the solution,
+# or None, and the numbers of oracle applications and shots used.
+
+def grover_sampler(sols, n_state_qubits, seed=None):
+    '''Sampler simulating Grover's algorithm with the marked 
+        states sols using grover_amplitudes'''
+    rng = np.random.default_rng(seed)
+    def sample(n_steps, shots):
+        probs = grover_amplitudes(sols, n_state_qubits, n_steps)**2
+        return rng.choice(len(probs), size=shots, 
+            p=probs/probs.sum()).tolist()
+    return sample
+
+def circuits_sampler(circuits, backend, seed=None):
+    '''Sampler running the circuits of GroverCircuits on backend'''
+    rng = np.random.default_rng(seed)
+    def sample(n_steps, shots):
+        qc = circuits.circuit(n_steps, backend)
+        counts = backend.run(qc, shots=shots, 
+            seed_simulator=int(rng.integers(2**31))).result().get_counts()
+        out = []
+        for outb, count in counts.items():
+            bits = outb[::-1]
+            out += count*[sum(int(bits[q]) << k 
+                for k, q in enumerate(circuits.state))]
+        return out
+    return sample
+
+def bbht_search(sample, verify, n_state_qubits, lam=6/5, 
+        max_oracle_calls=None, seed=None):
+    '''Search for a solution without knowing the number of solutions
+        using the randomized exponential schedule of Boyer, Brassard, 
+        Hoyer and Tapp. The expected number of oracle applications 
+        is at most 9/2*sqrt(N/M) for N states and M solutions. 
+        Give up after max_oracle_calls, by default twice this bound 
+        for M = 1, and return the solution None.'''
+    N = 2**n_state_qubits
+    if max_oracle_calls is None:
+        max_oracle_calls = 9*np.sqrt(N)
+    rng = np.random.default_rng(seed)
+    m, oracle_calls, shots = 1.0, 0, 0
+    while oracle_calls <= max_oracle_calls:
+        n_steps = int(rng.integers(int(np.ceil(m))))
+        [c] = sample(n_steps, 1)
+        oracle_calls += n_steps
+        shots += 1
+        if verify(c):
+            return {'solution': c, 'oracle_calls': oracle_calls, 
+                'shots': shots}
+        m = min(lam*m, np.sqrt(N))
+    return {'solution': None, 'oracle_calls': oracle_calls, 
+        'shots': shots}
+
+def estimate_num_solutions(sample, verify, n_state_qubits, 
+        schedule=(0, 1, 2, 4, 8, 16), shots=100):
+    '''Estimate the number of solutions by maximum likelihood 
+        amplitude estimation, running the numbers of steps in 
+        schedule shots times each and counting the verified outcomes.
+        This replaces the phase estimation of quantum counting, which 
+        would need the oracle controlled by another register.
+        Return a dictionary with the estimate num_sols and the numbers
+        of oracle applications and shots used.'''
+    thetas = np.linspace(0, np.pi/2, 2**14 + 1)
+    log_like = np.zeros_like(thetas)
+    for n_steps in schedule:
+        hits = sum([verify(c) for c in sample(n_steps, shots)])
+        p = np.clip(np.sin((2*n_steps + 1)*thetas)**2, 1e-12, 1 - 1e-12)
+        log_like += hits*np.log(p) + (shots - hits)*np.log(1 - p)
+    theta = thetas[np.argmax(log_like)]
+    return {'num_sols': int(np.rint(2**n_state_qubits*np.sin(theta)**2)),
+        'oracle_calls': shots*sum(schedule), 
+        'shots': shots*len(schedule)}
+
+def grover_search(sample, verify, n_state_qubits, num_sols=None, 
+        max_oracle_calls=None, max_shots=None, seed=None):
+    '''Search for a verified solution. When the number of solutions 
+        is known, e.g. counted classically or by 
+        estimate_num_solutions, run grover_n_steps(n_state_qubits, 
+        num_sols) steps at a time, and otherwise use bbht_search.
+        With a known number of solutions, the search stops after 
+        max_oracle_calls oracle calls or max_shots shots, which 
+        defaults to the number of shots fitting in max_oracle_calls,
+        counting the shots with 0 steps as single calls.'''
+    if num_sols is None:
+        return bbht_search(sample, verify, n_state_qubits, 
+            max_oracle_calls=max_oracle_calls, seed=seed)
+    if max_oracle_calls is None:
+        max_oracle_calls = 9*np.sqrt(2**n_state_qubits)
+    n_steps = grover_n_steps(n_state_qubits, max(num_sols, 1))
+    if max_shots is None:
+        max_shots = int(max_oracle_calls // max(n_steps, 1)) + 1
+    oracle_calls, shots = 0, 0
+    while (num_sols > 0 and oracle_calls <= max_oracle_calls 
+            and shots < max_shots):
+        [c] = sample(n_steps, 1)
+        oracle_calls += n_steps
+        shots += 1
+        if verify(c):
+            return {'solution': c, 'oracle_calls': oracle_calls, 
+                'shots': shots}
+    return {'solution': None, 'oracle_calls': oracle_calls, 
+        'shots': shots}
@@ -1,3 +1,5 @@
+import math
+from functools import cached_property
 import numpy as np
 
 class EdgeIndexing():
@@ -13,30 +15,34 @@ class EdgeIndexing():
             self.perm = list(range(num_nodes))
             self.perm = self.perm[perm:] + self.perm[:perm]
         else:
-            self.perm = perm
+            self.perm = list(perm)
+        self.perm_array = np.array(self.perm, dtype=np.int64)
+        self.inv_perm = np.empty(num_nodes, dtype=np.int64)
+        self.inv_perm[self.perm_array] = np.arange(num_nodes)
 
     def permute(self, i):
         '''Permuted index of given node'''
-        return self.perm.index(i)
+        return int(self.inv_perm[i])
 
     def unpermute(self, i):
         '''Inverse of permute'''
         return self.perm[i]
 
-    @property
+    @cached_property
     def edge_permutation(self):
         '''Permutation of the edges'''
         ix = EdgeIndexing(self.num_nodes)
-        return [ix.edge(*self.to_edge(i)) 
-            for i in range(self.num_edges)]
+        return ix.edges(*self.edge_table).tolist()
+
+    @cached_property
+    def edge_table(self):
+        '''Arrays js, ks such that to_edge(i) == (js[i], ks[i])'''
+        return self.to_edges(np.arange(self.num_edges))
 
     def num_edges_below_level(self, l):
         '''Number of elements in the strict upper triangle of 
             the incidence matrix above given row'''
-        out = 0
-        for k in range(l):
-            out += self.num_nodes - 1 - k
-        return out
+        return l*(2*self.num_nodes - l - 1)//2
 
     def edge(self, i, j):
         '''Index of the edge between nodes i and j'''
@@ -45,13 +51,37 @@ class EdgeIndexing():
             k, l = l, k
         return self.num_edges_below_level(k) + l - k - 1
 
+    def edges(self, js, ks):
+        '''Vectorized version of edge'''
+        k = self.inv_perm[np.asarray(js)]
+        l = self.inv_perm[np.asarray(ks)]
+        k, l = np.minimum(k, l), np.maximum(k, l)
+        return self.num_edges_below_level(k) + l - k - 1
+
     def to_edge(self, ind):
         '''Inverse of edge'''
-        for i in range(self.num_nodes-1):
-            if ind < self.num_edges_below_level(i+1):
-                j = ind - self.num_edges_below_level(i) + i + 1
-                return self.unpermute(i), self.unpermute(j)
-        raise IndexError('ind out of bounds')
+        if not 0 <= ind < self.num_edges:
+            raise IndexError('ind out of bounds')
+        # Count rows from the bottom, where they have 1, 2, ... elements
+        r = self.num_edges - 1 - ind
+        t = (math.isqrt(8*r + 1) - 1)//2
+        i = self.num_nodes - 2 - t
+        j = ind - self.num_edges_below_level(i) + i + 1
+        return self.unpermute(i), self.unpermute(j)
+
+    def to_edges(self, inds):
+        '''Vectorized version of to_edge'''
+        inds = np.asarray(inds, dtype=np.int64)
+        if np.any((inds < 0) | (inds >= self.num_edges)):
+            raise IndexError('ind out of bounds')
+        r = self.num_edges - 1 - inds
+        t = ((np.sqrt(8*r + 1) - 1)//2).astype(np.int64)
+        # Correct possible rounding errors of the floating point sqrt
+        t -= t*(t + 1)//2 > r
+        t += (t + 1)*(t + 2)//2 <= r
+        i = self.num_nodes - 2 - t
+        j = inds - self.num_edges_below_level(i) + i + 1
+        return self.perm_array[i], self.perm_array[j]
 
     @property
     def num_edges(self):
@@ -62,7 +92,7 @@ class EdgeIndexing():
         '''Return the nodes not in the given list of nodes'''
         all_nodes = set(range(self.num_nodes))
         return list(all_nodes.difference(set(nodes)))
-    
+
 class PathIndexing(EdgeIndexing):
     def __init__(self, num_nodes, perm=None, num_levels=None): 
         '''Indexing for paths of a graph with given number of nodes
@@ -81,7 +111,11 @@ class PathIndexing(EdgeIndexing):
     def num_paths_per_d(self):
         '''Number of paths per d where d is as in path below'''
         return self.num_edges_below_level(self.num_levels)
-    
+
     def path(self, d, i, j):
         '''Index of the dth path between nodes i and j'''
         return d*self.num_paths_per_d + self.edge(i, j)
+
+    def paths(self, d, js, ks):
+        '''Vectorized version of path'''
+        return np.asarray(d)*self.num_paths_per_d + self.edges(js, ks)
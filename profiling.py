@@ -0,0 +1,97 @@
+import json
+import sys
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+try:
+    import resource
+except ImportError: # Not available on Windows
+    resource = None
+
+def peak_rss():
+    '''Peak resident set size of the process in bytes,
+        or None if unknown'''
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes and macOS bytes
+    return rss if sys.platform == 'darwin' else 1024*rss
+
+def circuit_metrics(qc):
+    '''Number of qubits, size, depth and gate counts of a circuit,
+        without decomposing its gates'''
+    return {'num_qubits': qc.num_qubits, 'size': qc.size(),
+        'depth': qc.depth(), 'ops': dict(qc.count_ops())}
+
+class Profiler():
+    '''Opt-in records of the phases of building, transpiling and
+        simulating circuits
+        When enabled, each phase appends a dictionary with its name,
+        the names of the enclosing phases as path, the given info,
+        wall_time in seconds, peak_rss in bytes and the increase of
+        peak_rss during the phase, which is nonzero only for phases
+        that reach a new peak. Circuit metrics can be added to
+        the record by circuit.'''
+    def __init__(self):
+        self.enabled = False
+        self.records = []
+        self.stack = []
+
+    @contextmanager
+    def phase(self, name, **info):
+        '''Context manager recording a phase, yielding its record
+            or None when disabled'''
+        if not self.enabled:
+            yield None
+            return
+        record = {'phase': name, 'path': '/'.join(self.stack + [name]),
+            **info}
+        rss = peak_rss()
+        start = time.perf_counter()
+        self.stack.append(name)
+        try:
+            yield record
+        finally:
+            self.stack.pop()
+            record['wall_time'] = time.perf_counter() - start
+            record['peak_rss'] = peak_rss()
+            if rss is not None:
+                record['peak_rss_increase'] = record['peak_rss'] - rss
+            self.records.append(record)
+
+    def circuit(self, record, qc):
+        '''Add the metrics of circuit qc to record if it is not None'''
+        if record is not None:
+            record.update(circuit_metrics(qc))
+
+    def summary(self):
+        '''Number of records and total wall time per phase'''
+        out = defaultdict(lambda: {'count': 0, 'wall_time': 0.0})
+        for record in self.records:
+            out[record['phase']]['count'] += 1
+            out[record['phase']]['wall_time'] += record['wall_time']
+        return dict(out)
+
+    def to_json(self, path=None):
+        '''Export the records as JSON, written to path if given'''
+        text = json.dumps(self.records, indent=1, default=str)
+        if path is not None:
+            with open(path, 'w') as f:
+                f.write(text)
+        return text
+
+    def clear(self):
+        '''Drop the records'''
+        self.records.clear()
+
+profiler = Profiler()
+
+@contextmanager
+def profiling():
+    '''Enable profiler, which is used by circuits.py, grover.py and
+        execution.py, for the duration of the context and yield it'''
+    enabled, profiler.enabled = profiler.enabled, True
+    try:
+        yield profiler
+    finally:
+        profiler.enabled = enabled
@@ -0,0 +1,207 @@
+import numpy as np
+from collections import Counter
+from circuits import *
+from expected import *
+from grover import grover_n_steps
+
+class Resources():
+    '''Number of qubits and gates of a circuit
+        The gates are counted in a Counter with keys 'cx', 'ccx', 
+        'rccx', 'x', 'h', 'measure', and ('or', k), ('and', k), 
+        ('mcx', k) where k is the number of inputs, or controls, 
+        of the gate.'''
+    def __init__(self, qubits=0, gates=None):
+        self.qubits = qubits
+        self.gates = Counter() if gates is None else Counter(gates)
+
+    def add(self, other, times=1):
+        '''Add the gates of other times times'''
+        for gate, count in other.gates.items():
+            self.gates[gate] += times*count
+
+    @property
+    def toffolis(self):
+        '''Number of Toffoli gates when the wide gates are decomposed
+            using ancillas, see mcx_toffolis'''
+        out = 0
+        for gate, count in self.gates.items():
+            if gate in ['ccx', 'rccx']:
+                out += count
+            elif isinstance(gate, tuple):
+                out += count*mcx_toffolis(gate[1])
+        return out
+
+    @property
+    def t_count(self):
+        '''Upper bound for the number of T gates'''
+        return 7*self.toffolis
+
+    @property
+    def num_gates(self):
+        '''Number of Toffolis and single qubit and CNOT gates, which
+            bounds the depth from above'''
+        return self.toffolis + sum(count
+            for gate, count in self.gates.items()
+            if gate in ['cx', 'x', 'h'])
+
+    def summary(self):
+        '''Resources as a dictionary of numbers'''
+        out = {'qubits': self.qubits, 'toffolis': self.toffolis,
+            't_count': self.t_count, 'num_gates': self.num_gates}
+        for gate, count in sorted(self.gates.items(), key=str):
+            if count == 0:
+                continue
+            if isinstance(gate, tuple):
+                gate = f'{gate[0]}{gate[1]}'
+            out[gate] = count
+        return out
+
+def mcx_toffolis(k):
+    '''Number of Toffoli gates in a gate with k controls decomposed
+        as a V-chain using k - 2 clean ancillas'''
+    if k < 2:
+        return 0
+    return 2*k - 3
+
+def mcx_gate(k):
+    '''Key of the multi-controlled X gate with k controls as 
+        appended by QuantumCircuit.mcx'''
+    return {1: 'cx', 2: 'ccx'}.get(k, ('mcx', k))
+
+def paths_resources(ix, num_d_steps, fixed=None, needed=None):
+    '''Resources of Paths(ix, num_d_steps, fixed, needed)'''
+    if fixed is None:
+        fixed = {}
+    if needed is None:
+        needed = np.full((num_d_steps, ix.num_paths_per_d), True)
+    n, num_paths = ix.num_nodes, int(needed.sum())
+    res = Resources(ix.num_edges - len(fixed) + num_paths + n - 2)
+    if len(fixed) == 0:
+        res.gates['ccx'] = 2*(n - 2)*num_paths
+        res.gates[('or', n - 1)] = num_paths
+        return res
+    evars = edges_vars(range(ix.num_edges - len(fixed)),
+        ix.num_edges, fixed)
+    paths = paths_vars(range(ix.num_edges, ix.num_edges + num_paths),
+        needed)
+    for d in range(num_d_steps):
+        for i in range(ix.num_paths_per_d):
+            if not needed[d, i]:
+                continue
+            pairs, single, _ = paths_test1_vars(evars, paths, ix, d, i)
+            pairs, singles = fold_test1_constants(pairs, single)
+            if singles is True:
+                res.gates['x'] += 1
+                continue
+            res.gates['ccx'] += 2*len(pairs)
+            if len(pairs) + len(singles) > 0:
+                res.gates[('or', len(pairs) + len(singles))] += 1
+    return res
+
+def dist_check_resources(ix, ds, fixed=None):
+    '''Resources of Dist_check(ix, ds, fixed)'''
+    flags = dist_check_test2_flags(ix, ds)
+    num_d_steps = flags.shape[0] - 1
+    needed = paths_cone(ix, ds, num_d_steps)
+    paths = paths_resources(ix, num_d_steps, fixed, needed)
+    res = Resources(paths.qubits + 1)
+    res.add(paths, 2)
+    num_unknown = ix.num_edges - (0 if fixed is None else len(fixed))
+    evars = edges_vars(range(num_unknown), ix.num_edges,
+        {} if fixed is None else fixed)
+    vals = evars[:ix.num_paths_per_d] + paths_vars(range(num_unknown,
+        num_unknown + int(needed.sum())), needed)
+    vals, flags = fold_test2_constants(vals, flags.flatten().tolist())
+    if flags is True:
+        res.gates['x'] += 1
+    elif flags is not False:
+        res.gates[('and', len(vals))] += 1
+    return res
+
+def dist_check_groups_resources(ds_groups, fixed=None):
+    '''Resources of Dist_check_groups(ds_groups, fixed)'''
+    if fixed is None:
+        fixed = {}
+    ix, _ = ds_groups[0]
+    paths_size = max([dist_check_paths_size(ix, ds)
+        for ix, ds in ds_groups])
+    res = Resources(ix.num_edges - len(fixed) + paths_size
+        + ix.num_nodes - 2 + len(ds_groups) + 1)
+    for ix, ds in ds_groups:
+        res.add(dist_check_resources(ix, ds,
+            group_fixed_edges(ix, fixed)), 2)
+    res.gates[('and', len(ds_groups))] += 1
+    return res
+
+def grover_resources(bitflip, n_state_qubits, n_steps=-1):
+    '''Resources of grover(Bitflip2Phaseflip(oracle), state, n_steps)
+        where bitflip are the resources of oracle and state has
+        n_state_qubits qubits'''
+    if n_steps < 0:
+        n_steps = grover_n_steps(n_state_qubits)
+    res = Resources(bitflip.qubits)
+    res.gates['h'] += n_state_qubits
+    res.add(bitflip, n_steps)
+    res.gates['x'] += n_steps*(2 + 2*n_state_qubits)
+    res.gates['h'] += n_steps*(4 + 2*n_state_qubits)
+    res.gates[mcx_gate(n_state_qubits - 1)] += n_steps
+    res.gates['measure'] += bitflip.qubits
+    return res
+
+def count_gates(qc):
+    '''Count the resources of a constructed circuit for comparison
+        with the estimates'''
+    res = Resources(qc.num_qubits)
+    def walk(qc):
+        for instruction in qc.data:
+            op = instruction.operation
+            name = op.name.removesuffix('_dg')
+            if name in ['cx', 'ccx', 'rccx', 'x', 'h', 'measure']:
+                res.gates[name] += 1
+            elif name in ['or', 'and', 'mcx']:
+                res.gates[(name, op.num_qubits - 1)] += 1
+            elif op.definition is not None:
+                walk(op.definition)
+    walk(qc)
+    return res
+
+def known_dmat(dmat, density, rng):
+    '''Distance matrix where a random subset of the pairs of nodes
+        with the given density is known and the rest are set to inf'''
+    n, _ = dmat.shape
+    known = np.triu(rng.random((n, n)) < density, 1)
+    known = known | known.T
+    return np.where(known, dmat, np.inf)
+
+def sweep_resources(ns, densities, edge_prob=0.5, fix_edges=False,
+        seed=0):
+    '''Estimate the resources of Dist_check and Dist_check_groups,
+        with groups given by dmat2ds_groups, and of a full run of
+        Grover's algorithm for random graphs with n nodes for n in ns
+        and known pairs with given densities. Return a list of
+        dictionaries.'''
+    rng = np.random.default_rng(seed)
+    rows = []
+    for n in ns:
+        imat = np.triu(rng.random((n, n)) < edge_prob, 1)
+        dmat = dmat_expected(imat | imat.T)
+        for density in densities:
+            dmat_known = known_dmat(dmat, density, rng)
+            ix, ds = dmat2ds(dmat_known)
+            if len(ds) == 0:
+                continue
+            ds_groups = dmat2ds_groups(dmat_known)
+            fixed = dist_check_fixed_edges(ix, ds) if fix_edges else {}
+            n_state_qubits = ix.num_edges - len(fixed)
+            for grouped in [False, True]:
+                if grouped:
+                    res = dist_check_groups_resources(ds_groups, fixed)
+                else:
+                    res = dist_check_resources(ix, ds, fixed)
+                grover = grover_resources(res, n_state_qubits)
+                rows.append({'n': n, 'density': density,
+                    'grouped': grouped, 'n_state_qubits': n_state_qubits,
+                    **res.summary(),
+                    'grover_toffolis': grover.toffolis,
+                    'grover_t_count': grover.t_count})
+    return rows
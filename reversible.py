@@ -0,0 +1,74 @@
+import numpy as np
+from qiskit.circuit import ControlledGate
+from classical import ONES
+
+def reversible_ops(qc):
+    '''Flatten a circuit built from X gates and multi-controlled X
+        gates, possibly inside gate definitions such as OR and AND,
+        to a list of (controls, ctrl_state, target) with qubit indices
+        of qc. Raise ValueError for gates that do not permute the
+        computational basis this way.'''
+    ops = []
+    def walk(qc, qubits):
+        for instruction in qc.data:
+            op = instruction.operation
+            inds = [qubits[qc.find_bit(q).index]
+                for q in instruction.qubits]
+            if op.name in ['barrier', 'measure']:
+                continue
+            elif op.name == 'x':
+                ops.append(((), 0, inds[0]))
+            elif op.name == 'rccx':
+                # Relative-phase Toffoli acts as Toffoli on basis states
+                ops.append((tuple(inds[:2]), 3, inds[2]))
+            elif (isinstance(op, ControlledGate)
+                    and op.base_gate.name == 'x'):
+                k = op.num_ctrl_qubits
+                ops.append((tuple(inds[:k]), op.ctrl_state, inds[k]))
+            elif op.definition is not None:
+                walk(op.definition, inds)
+            else:
+                raise ValueError(f'Gate {op.name} is not reversible logic')
+    walk(qc, list(range(qc.num_qubits)))
+    return ops
+
+def run_reversible(ops, state):
+    '''Apply the ops given by reversible_ops in place to a state
+        of shape (num_qubits, num_words) with the basis states
+        bit-sliced as in classical.pack_candidates'''
+    for controls, ctrl_state, target in ops:
+        acc = np.full(state.shape[1], ONES)
+        for k, control in enumerate(controls):
+            if ctrl_state >> k & 1:
+                acc &= state[control]
+            else:
+                acc &= ~state[control]
+        state[target] ^= acc
+    return state
+
+def reg_indices(qc, name):
+    '''Indices of the qubits in the named register of qc'''
+    reg = [reg for reg in qc.qregs if reg.name == name][0]
+    return [qc.find_bit(q).index for q in reg]
+
+def simulate_reversible(qc, init_regs, ops=None):
+    '''Run qc on a batch of basis states where the named registers
+        are initialized with bit-sliced values and the rest are zero.
+        Here init_regs = [(name0, words0), (name1, words1), ...]
+        with words of shape (register size, num_words).'''
+    if ops is None:
+        ops = reversible_ops(qc)
+    num_words = init_regs[0][1].shape[1]
+    state = np.zeros((qc.num_qubits, num_words), dtype=np.uint64)
+    for name, words in init_regs:
+        state[reg_indices(qc, name)] = words
+    return run_reversible(ops, state)
+
+def workspace_clean(qc, state, names):
+    '''Bit-sliced words with the bits set for the basis states whose
+        named registers are full of zeros'''
+    out = np.full(state.shape[1], ONES)
+    for name in names:
+        for ind in reg_indices(qc, name):
+            out &= ~state[ind]
+    return out
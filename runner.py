@@ -0,0 +1,253 @@
+'''Run Grover's algorithm on a batch of instances read from JSONL
+
+Each line of the input is an instance, a JSON object with an optional
+id and either
+
+    {"num_nodes": 4, "edges": [[0, 1], [1, 2]], "pairs_known": [[0, 2]]}
+
+where pairs_known defaults to all pairs, or a distance table with null
+for the unknown distances, {"dmat": [[0, 2, null], ...]}. Optional keys
+are grouped (use Dist_check_groups), n_steps and true_edges, which
+defaults to edges. Run e.g.
+
+    python runner.py instances.jsonl results.jsonl --workers 4
+
+The results are appended to the output as the instances finish, and
+the instances already in the output are skipped, so that interrupted
+runs resume.'''
+import argparse
+import json
+import multiprocessing as mp
+import sys
+import time
+from collections import Counter
+from multiprocessing.connection import wait
+import numpy as np
+try:
+    import resource
+except ImportError: # Not available on Windows
+    resource = None
+from indexing import PathIndexing
+from circuits import *
+from expected import *
+from classical import *
+from grover import *
+from execution import select_backend
+from profiling import profiling
+
+def parse_instance(instance):
+    '''Known distances of an instance and its true edges, or None'''
+    if 'dmat' in instance:
+        dmat = np.array([[np.inf if d is None else d for d in row]
+            for row in instance['dmat']], dtype=float)
+        n, _ = dmat.shape
+    else:
+        n = instance['num_nodes']
+        dmat = dmat_expected(instance['edges'], n)
+        pairs = instance.get('pairs_known')
+        if pairs is not None:
+            known = np.full((n, n), False)
+            for j, k in pairs:
+                known[j, k] = known[k, j] = True
+            dmat = np.where(known, dmat, np.inf)
+    true_edges = instance.get('true_edges', instance.get('edges'))
+    if true_edges is not None:
+        true_edges = imat2edges(PathIndexing(n), true_edges)
+    return dmat, true_edges
+
+def int2bools(c, num_bits):
+    '''Bits of the integer c, the bit k first'''
+    return np.array([c >> k & 1 for k in range(num_bits)], dtype=bool)
+
+def bools2int(bs):
+    '''Inverse of int2bools'''
+    return sum([int(b) << k for k, b in enumerate(bs)])
+
+def run_instance(instance, shots=1000, strategy='auto', fix_edges=True,
+        max_amplitude_qubits=24, memory_limit=None, seed=None):
+    '''Run Grover's algorithm on an instance and return a dictionary
+        of results. With strategy='amplitude', the solutions are
+        enumerated classically and the algorithm is simulated on the
+        amplitudes, and with strategy='aer' the circuits are run
+        on the Aer method chosen by select_backend. The default 'auto'
+        uses the former when the search space has at most
+        max_amplitude_qubits qubits.'''
+    start = time.perf_counter()
+    dmat, true_edges = parse_instance(instance)
+    ix, ds = dmat2ds(dmat)
+    if len(ds) == 0:
+        raise ValueError('No known distances')
+    fixed = dist_check_fixed_edges(ix, ds) if fix_edges else {}
+    num_unknown = ix.num_edges - len(fixed)
+    if strategy == 'auto':
+        strategy = ('amplitude' if num_unknown <= max_amplitude_qubits
+            else 'aer')
+    sols = None
+    if strategy == 'amplitude' or num_unknown <= max_amplitude_qubits:
+        sols = c_dist_check_solutions(ix, ds, fixed)
+    n_steps = instance.get('n_steps',
+        grover_n_steps(num_unknown, len(sols) if sols else 1))
+    result = {'status': 'ok', 'strategy': strategy,
+        'num_nodes': ix.num_nodes, 'n_state_qubits': num_unknown,
+        'n_steps': n_steps, 'num_sols': None if sols is None else len(sols)}
+    verify = lambda c: bool(c_dist_check(
+        expand_edges(int2bools(c, num_unknown), fixed, ix.num_edges),
+        ix, ds))
+    with profiling() as prof:
+        prof.clear()
+        if strategy == 'amplitude':
+            probs = grover_amplitudes(sols, num_unknown, n_steps)**2
+            probs = {c: float(probs[c]) for c in np.flatnonzero(probs)}
+        elif strategy == 'aer' and num_unknown == 0:
+            # The only candidate has all edges fixed and is checked 
+            # classically below
+            probs = {0: 1.0}
+        elif strategy == 'aer':
+            if instance.get('grouped', False):
+                oracle = dist_check_groups_circuit(dmat2ds_groups(dmat),
+                    fixed)
+            else:
+                oracle = dist_check_circuit(ix, ds, fixed)
+            circuits = GroverCircuits(Bitflip2Phaseflip(oracle),
+                range(num_unknown))
+            backend = select_backend(circuits.circuit(n_steps),
+                memory_limit)
+            result['num_qubits'] = oracle.num_qubits
+            result['method'] = backend.options.method
+            counts = Counter(circuits_sampler(circuits, backend,
+                seed)(n_steps, shots))
+            probs = {c: count/shots for c, count in counts.items()}
+        else:
+            raise ValueError(f'Unknown strategy {strategy}')
+    most_frequent = max(probs, key=probs.get)
+    result['most_frequent'] = bools2str(expand_edges(
+        int2bools(most_frequent, num_unknown), fixed, ix.num_edges))
+    result['most_frequent_is_solution'] = verify(most_frequent)
+    if sols is not None:
+        result['solution_probability'] = sum([probs.get(c, 0)
+            for c in sols])
+    if true_edges is not None:
+        result['success_probability'] = probs.get(
+            bools2int(reduce_edges(true_edges, fixed)), 0)
+    result['timings'] = {phase: summary['wall_time']
+        for phase, summary in prof.summary().items()}
+    result['timings']['total'] = time.perf_counter() - start
+    return result
+
+def worker(instance, options, conn):
+    '''Run an instance in a child process, limiting its address space
+        to options['memory_limit'] bytes, and send the result'''
+    memory_limit = options.get('memory_limit')
+    if memory_limit is not None and resource is not None:
+        resource.setrlimit(resource.RLIMIT_AS, (memory_limit, memory_limit))
+    try:
+        result = run_instance(instance, **options)
+    except MemoryError as e:
+        result = {'status': 'memory', 'error': str(e)}
+    except Exception as e:
+        result = {'status': 'error', 'error': repr(e)}
+    conn.send(result)
+    conn.close()
+
+def read_jsonl(path):
+    '''Read a list of JSON objects, one per line'''
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def finished_ids(path):
+    '''Ids of the instances with results in the output path, 
+        ignoring a last line cut short by an interrupted run'''
+    ids = set()
+    try:
+        with open(path) as f:
+            for line in f:
+                try:
+                    ids.add(json.loads(line)['id'])
+                except (json.JSONDecodeError, KeyError):
+                    pass
+    except FileNotFoundError:
+        pass
+    return ids
+
+def run_batch(instances, out_path, workers=1, timeout=None, **options):
+    '''Run the instances in a pool of workers processes, one process
+        per instance, and append the results to out_path as JSONL as
+        they finish. An instance is stopped with the status 'timeout'
+        after timeout seconds. Instances whose id is found in out_path
+        are skipped; the id defaults to the position in instances.
+        Yield the results.'''
+    done = finished_ids(out_path)
+    pending = [(instance.get('id', i), instance)
+        for i, instance in enumerate(instances)
+        if instance.get('id', i) not in done]
+    pending.reverse()
+    # Forking a process that has run Aer threads can deadlock
+    context = mp.get_context('spawn')
+    running = {}
+    with open(out_path, 'a+') as out:
+        out.seek(0)
+        text = out.read()
+        if not text.endswith('\n'):
+            # Drop a last line cut short by an interrupted run
+            out.truncate(len(text[:text.rfind('\n') + 1].encode()))
+        while pending or running:
+            while pending and len(running) < workers:
+                id, instance = pending.pop()
+                recv, send = context.Pipe(duplex=False)
+                process = context.Process(target=worker,
+                    args=(instance, options, send))
+                process.start()
+                send.close()
+                running[id] = (process, recv, time.perf_counter())
+            wait([recv for _, recv, _ in running.values()], timeout=0.1)
+            for id, (process, recv, start) in list(running.items()):
+                elapsed = time.perf_counter() - start
+                alive = process.is_alive()
+                if recv.poll():
+                    try:
+                        result = recv.recv()
+                    except EOFError:
+                        result = {'status': 'crashed',
+                            'exitcode': process.exitcode}
+                elif timeout is not None and elapsed > timeout:
+                    process.terminate()
+                    result = {'status': 'timeout'}
+                elif not alive:
+                    result = {'status': 'crashed',
+                        'exitcode': process.exitcode}
+                else:
+                    continue
+                process.join()
+                del running[id]
+                result = {'id': id, **result, 'wall_time': elapsed}
+                out.write(json.dumps(result) + '\n')
+                out.flush()
+                yield result
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('instances', help='input JSONL')
+    parser.add_argument('results', help='output JSONL, appended to')
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--timeout', type=float,
+        help='seconds per instance')
+    parser.add_argument('--memory-gib', type=float,
+        help='address space limit per instance in GiB')
+    parser.add_argument('--shots', type=int, default=1000)
+    parser.add_argument('--strategy', default='auto',
+        choices=['auto', 'amplitude', 'aer'])
+    parser.add_argument('--no-fix-edges', action='store_true',
+        help='do not hard-wire the edges determined by distances')
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args(argv)
+    memory_limit = (None if args.memory_gib is None
+        else int(args.memory_gib*2**30))
+    for result in run_batch(read_jsonl(args.instances), args.results,
+            args.workers, args.timeout, shots=args.shots,
+            strategy=args.strategy, fix_edges=not args.no_fix_edges,
+            memory_limit=memory_limit, seed=args.seed):
+        print(json.dumps(result))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
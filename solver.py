@@ -0,0 +1,243 @@
+import numpy as np
+from indexing import EdgeIndexing
+from circuits import dist_check_test2_flags, paths_cone, paths_test1_vars
+
+def ds2dmat(ds_groups):
+    '''Matrix of the distances in ds_groups, grouped as in
+        c_dist_check_groups, with inf for the unknown distances'''
+    ix, _ = ds_groups[0]
+    dmat = np.full((ix.num_nodes, ix.num_nodes), np.inf)
+    for ix, ds in ds_groups:
+        for i, d in ds:
+            j, k = ix.to_edge(i)
+            dmat[j, k] = dmat[k, j] = d
+    return dmat
+
+def graph_distances(adj):
+    '''Distances in the graph with the boolean incidence matrix adj,
+        computed by breadth-first search from all nodes at once'''
+    n = len(adj)
+    dist = np.full((n, n), np.inf)
+    reach = np.eye(n, dtype=bool)
+    dist[reach] = 0
+    for d in range(1, n):
+        new = reach | (reach @ adj)
+        if np.array_equal(new, reach):
+            break
+        dist[new & ~reach] = d
+        reach = new
+    return dist
+
+def via_edges(dist, a, b):
+    '''Array of shape (len(a), n, n) with the lengths of the shortest
+        walks from j to k through the edge (a[e], b[e]) at [e, j, k],
+        given the distances dist'''
+    return np.minimum(dist[:, a].T[:, :, None] + dist[b][:, None, :],
+        dist[:, b].T[:, :, None] + dist[a][:, None, :]) + 1
+
+def metric_closure(upper):
+    '''Tighten upper bounds of distances by the triangle inequality'''
+    for k in range(len(upper)):
+        upper = np.minimum(upper, upper[:, [k]] + upper[[k], :])
+    return upper
+
+def propagate(dmat, present, undecided):
+    '''Decide the undecided edges implied by the known distances in
+        dmat, updating the boolean incidence matrices present and
+        undecided in place. Return False if no graph is consistent.
+        The distances in the graph of the present edges, tightened by
+        the known distances and the triangle inequality, bound the
+        distances from above, and the distances in the graph of
+        the present and undecided edges bound them from below. An edge
+        is absent if adding it breaks an upper bound, and present if
+        removing it breaks a lower bound.'''
+    known = dmat != np.inf
+    while True:
+        upper = metric_closure(np.where(known, dmat,
+            graph_distances(present)))
+        lower = graph_distances(present | undecided)
+        if np.any(known & ((upper < dmat) | (lower > dmat))):
+            return False
+        a, b = np.nonzero(np.triu(undecided))
+        if len(a) == 0:
+            return True
+        absent = np.any(known & (via_edges(upper, a, b) < dmat), 
+            axis=(1, 2))
+        needed = np.full(len(a), False)
+        for e in np.flatnonzero(~absent):
+            optimistic = present | undecided
+            optimistic[a[e], b[e]] = optimistic[b[e], a[e]] = False
+            needed[e] = np.any(known & (graph_distances(optimistic) > dmat))
+        if not absent.any() and not needed.any():
+            return True
+        decided = absent | needed
+        undecided[a[decided], b[decided]] = False
+        undecided[b[decided], a[decided]] = False
+        present[a[needed], b[needed]] = present[b[needed], a[needed]] = True
+
+def branch_and_bound(dmat, present, undecided, free, stats):
+    '''Find all graphs with the known distances dmat that extend
+        present by some undecided or free edges, where the free edges
+        do not change the known distances, counting the search nodes
+        in stats['nodes_explored']. Return a list of pairs (present, 
+        free) of incidence matrices such that present with any subset
+        of the edges free added is a solution.'''
+    stats['nodes_explored'] += 1
+    if not propagate(dmat, present, undecided):
+        return []
+    known = dmat != np.inf
+    # An edge is free if no walk through it is short enough to
+    # count for a known distance, even with all undecided edges
+    lower = graph_distances(present | undecided)
+    a, b = np.nonzero(np.triu(undecided))
+    uses = np.sum(known & (via_edges(lower, a, b) <= dmat), axis=(1, 2))
+    free = free.copy()
+    free[a[uses == 0], b[uses == 0]] = True
+    free[b[uses == 0], a[uses == 0]] = True
+    undecided = undecided & ~free
+    # Adding edges only shortens distances, so if the known distances
+    # hold without and with all undecided edges, they hold for any
+    if np.all((graph_distances(present) == dmat)[known]) and np.all(
+            (lower == dmat)[known]):
+        return [(present, free | undecided)]
+    # Branch on the edge with the most walks counting for the known 
+    # distances
+    e = np.argmax(uses)
+    sols = []
+    for value in [False, True]:
+        branch_present, branch_undecided = present.copy(), undecided.copy()
+        branch_undecided[a[e], b[e]] = branch_undecided[b[e], a[e]] = False
+        branch_present[a[e], b[e]] = branch_present[b[e], a[e]] = value
+        sols.extend(branch_and_bound(dmat, branch_present,
+            branch_undecided, free, stats))
+    return sols
+
+def solve(ds_groups, ix=None, fixed=None, list_solutions=True):
+    '''Find all graphs with the distances ds_groups, grouped as in
+        c_dist_check_groups, by constraint propagation and
+        branch-and-bound. The solutions are integers whose bits are
+        the edges in the indexing ix, by default EdgeIndexing, that
+        are not in the dictionary fixed, as in c_solutions. Return a
+        dictionary with the sorted solutions, unless list_solutions
+        False, their number, the number of search nodes explored and
+        the number of edges decided before branching.'''
+    if fixed is None:
+        fixed = {}
+    dmat = ds2dmat(ds_groups)
+    n, _ = dmat.shape
+    if ix is None:
+        ix = EdgeIndexing(n)
+    js, ks = ix.edge_table
+    # A distance 1 is an edge and a distance >= 2 is not
+    known = dmat != np.inf
+    present = known & (dmat == 1)
+    undecided = ~known & ~np.eye(n, dtype=bool)
+    inds = np.array(list(fixed), dtype=np.int64)
+    vals = np.array(list(fixed.values()), dtype=bool)
+    consistent = np.all(undecided[js[inds], ks[inds]]
+        | (present[js[inds], ks[inds]] == vals))
+    undecided[js[inds], ks[inds]] = undecided[ks[inds], js[inds]] = False
+    present[js[inds], ks[inds]] = present[ks[inds], js[inds]] = vals
+    num_undecided = np.triu(undecided).sum()
+    out = {'num_solutions': 0, 'nodes_explored': 0, 
+        'edges_propagated': 0}
+    sols = []
+    if consistent and propagate(dmat, present, undecided):
+        out['edges_propagated'] = int(num_undecided
+            - np.triu(undecided).sum())
+        unknown = [i for i in range(ix.num_edges) if i not in fixed]
+        for present, free in branch_and_bound(dmat, present, undecided,
+                np.full((n, n), False), out):
+            free_bits = np.flatnonzero(free[js[unknown], ks[unknown]])
+            out['num_solutions'] += 2**len(free_bits)
+            if not list_solutions:
+                continue
+            subsets = [sum([1 << int(k) for k in 
+                np.flatnonzero(present[js[unknown], ks[unknown]])])]
+            for k in free_bits:
+                subsets += [c | 1 << int(k) for c in subsets]
+            sols.extend(subsets)
+    if list_solutions:
+        out['solutions'] = sorted(sols)
+    return out
+
+def solve_dist_check(ix, ds, fixed=None, list_solutions=True):
+    '''Solver version of c_dist_check_solutions, see solve'''
+    return solve([(ix, ds)], ix, fixed, list_solutions)
+
+def solve_dist_check_groups(ds_groups, fixed=None, list_solutions=True):
+    '''Solver version of c_dist_check_groups_solutions, see solve'''
+    return solve(ds_groups, None, fixed, list_solutions)
+
+# Export to conjunctive normal form
+#
+# The clauses are lists of nonzero integers as in the DIMACS format,
+# where the variable v is true in the literal v and false in -v.
+# The variables 1, ..., num_edges are the edges. Test 1 introduces a
+# variable for each needed path and each AND of a pair of variables,
+# defined by clauses equivalent to out <-> single OR (a1 AND b1) ...,
+# and Test 2 adds a unit clause for each nonzero flag.
+
+def append_dist_check_clauses(clauses, evars, ix, ds, num_vars):
+    '''Append the clauses of c_dist_check(edges, ix, ds) where
+        evars lists the variables of the edges of ix,
+        numbering new variables after num_vars. Return the number
+        of variables.'''
+    flags = dist_check_test2_flags(ix, ds)
+    needed = paths_cone(ix, ds, flags.shape[0] - 1)
+    pvars = [None]*needed.size
+    for ind in np.flatnonzero(needed):
+        num_vars += 1
+        pvars[ind] = num_vars
+    for d, i in zip(*np.nonzero(needed)):
+        pairs, single, out = paths_test1_vars(evars, pvars, ix, d, i)
+        ins = [single]
+        for a, b in pairs:
+            num_vars += 1
+            clauses.extend([[-num_vars, a], [-num_vars, b],
+                [num_vars, -a, -b]])
+            ins.append(num_vars)
+        clauses.extend([[-v, out] for v in ins])
+        clauses.append([-out] + ins)
+    vals = evars[:ix.num_paths_per_d] + pvars
+    for val, flag in zip(vals, flags.flatten().tolist()):
+        if flag != 0:
+            clauses.append([flag*val])
+    return num_vars
+
+def dist_check_groups_cnf(ds_groups, ix=None, fixed=None):
+    '''Clauses satisfiable exactly when the edges have the distances
+        ds_groups, grouped as in c_dist_check_groups, with unit
+        clauses for the edges in the dictionary fixed. The variable
+        i + 1 is the edge i of ix, by default EdgeIndexing. Return
+        the number of variables and the list of clauses.'''
+    ix_groups, _ = ds_groups[0]
+    if ix is None:
+        ix = EdgeIndexing(ix_groups.num_nodes)
+    if fixed is None:
+        fixed = {}
+    # Variables of the edges in the default order of EdgeIndexing
+    evars = (ix.edges(*EdgeIndexing(ix.num_nodes).edge_table)
+        + 1).tolist()
+    clauses = [[i + 1 if val else -(i + 1)] for i, val in fixed.items()]
+    num_vars = ix.num_edges
+    for ix_group, ds in ds_groups:
+        num_vars = append_dist_check_clauses(clauses,
+            [evars[j] for j in ix_group.edge_permutation], ix_group, ds,
+            num_vars)
+    return num_vars, clauses
+
+def dist_check_cnf(ix, ds, fixed=None):
+    '''Clauses of c_dist_check(edges, ix, ds), see
+        dist_check_groups_cnf'''
+    return dist_check_groups_cnf([(ix, ds)], ix, fixed)
+
+def to_dimacs(num_vars, clauses, path=None):
+    '''Export clauses in the DIMACS format, written to path if given'''
+    lines = [f'p cnf {num_vars} {len(clauses)}']
+    lines += [' '.join(map(str, clause + [0])) for clause in clauses]
+    text = '\n'.join(lines) + '\n'
+    if path is not None:
+        with open(path, 'w') as f:
+            f.write(text)
+    return text
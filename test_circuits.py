@@ -2,8 +2,22 @@ from indexing import *
 from circuits import *
 from expected import *
 from classical import *
+from grover import *
+from resources import *
+from reversible import *
+from execution import *
+from grouping import *
+from profiling import *
+from solver import *
+import benchmark
+import runner
 import qiskit_aer
 import qiskit as qk
+from qiskit.quantum_info import Operator, Statevector
+from qiskit.providers.fake_provider import GenericBackendV2
+import json
+import pytest
+from scipy import sparse as spr
 
 def find_bits_in_reg(qc, name):
     '''Find the indices of qubits in named quantum register 
@@ -72,6 +86,60 @@ def q_dist_check_groups(edges, ds_groups):
     assert_reg_is_zero(outb, qc, 'ancs2')
     return str2bools(outb)[-1]
 
+def r_bits(qc, state, name):
+    '''Values of the named register for the first basis state 
+        in a bit-sliced state'''
+    return [bool(state[i][0] & 1) for i in reg_indices(qc, name)]
+
+def r_run(qc, edges, workspace):
+    '''Run qc on the basis state given by edges using 
+        the reversible simulator and assert that the named 
+        workspace registers are full of zeros'''
+    state = simulate_reversible(qc, 
+        [('edges', pack_candidates([edges]))])
+    assert workspace_clean(qc, state, workspace)[0] & 1
+    return state
+
+def r_paths(edges, ix, num_d_steps):
+    '''Compute paths using the reversible simulation of Paths'''
+    qc = Paths(ix, num_d_steps)
+    return r_bits(qc, r_run(qc, edges, ['ancs']), 'paths')
+
+def r_dist_check(edges, ix, ds):
+    '''Check distances using the reversible simulation of 
+        Dist_check'''
+    qc = Dist_check(ix, ds)
+    return r_bits(qc, r_run(qc, edges, ['paths', 'ancs']), 'out')[0]
+
+def r_dist_check_groups(edges, ds_groups):
+    '''Check grouped distances using the reversible simulation of 
+        Dist_check_groups'''
+    qc = Dist_check_groups(ds_groups)
+    workspace = ['paths', 'ancs1', 'ancs2']
+    return r_bits(qc, r_run(qc, edges, workspace), 'out')[0]
+
+def qb_outputs(qc, edges_list, workspace, **kwargs):
+    '''Run qc on all the given edges in one batch, assert that the 
+        named workspace registers are full of zeros and return 
+        the values of the last qubit. The keyword arguments are 
+        passed to run_basis_states.'''
+    outs = [None]*len(edges_list)
+    for i, outb in run_basis_states(qc, 
+            [[('edges', edges)] for edges in edges_list], **kwargs):
+        for name in workspace:
+            assert_reg_is_zero(outb, qc, name)
+        outs[i] = str2bools(outb)[-1]
+    return outs
+
+def qb_dist_check(edges_list, ix, ds):
+    '''Batched version of q_dist_check'''
+    return qb_outputs(Dist_check(ix, ds), edges_list, ['paths', 'ancs'])
+
+def qb_dist_check_groups(edges_list, ds_groups):
+    '''Batched version of q_dist_check_groups'''
+    return qb_outputs(Dist_check_groups(ds_groups), edges_list, 
+        ['paths', 'ancs1', 'ancs2'])
+
 def bits2imat(ix, b):
     '''Convert bit string to incidence matrix'''
     imat = np.full((ix.num_nodes,ix.num_nodes), False)
@@ -137,26 +205,32 @@ def run_test_dist_check_self(fun, use_groups=False):
                 if len(ds) > 0:
                     assert fun(edges, ixp, ds)
 
-def run_test_dist_check_tree(fun, imat_tree, use_groups=False):
+def run_test_dist_check_tree(fun, imat_tree, use_groups=False, 
+        batch=False):
     '''Assert that fun, performing the distance check, 
-        can be used to find a given tree from its distances'''
+        can be used to find a given tree from its distances
+        When batch is True, fun checks a list of edges at once.'''
     if use_groups:
         dists = [dmat2ds_groups(dmat_expected(imat_tree))]
     else:
         dists = dmat2ds(dmat_expected(imat_tree))
     ix, ds = dmat2ds(dmat_expected(imat_tree))
     edges_tree = imat2edges(ix, imat_tree)
-    for i in range(2**ix.num_edges):
-        b = format(i, f'0{ix.num_edges}b')
-        imat = bits2imat(ix, b)
-        edges = imat2edges(ix, imat)
-        if fun(edges, *dists) == np.array_equal(edges, edges_tree):
+    bs = [format(i, f'0{ix.num_edges}b') for i in range(2**ix.num_edges)]
+    edges_list = [imat2edges(ix, bits2imat(ix, b)) for b in bs]
+    if batch:
+        rets = fun(edges_list, *dists)
+    else:
+        rets = [fun(edges, *dists) for edges in edges_list]
+    for b, edges, ret in zip(bs, edges_list, rets):
+        if ret == np.array_equal(edges, edges_tree):
             print(f'{b} passes')
         else:
             print(f'{b} FAILS')
             assert False
 
-def run_test_dist_check_trees(fun_dist_check, use_groups=False):
+def run_test_dist_check_trees(fun_dist_check, use_groups=False, 
+        batch=False):
     '''Assert that fun, performing the distance check, 
         correctly finds a couple of trees from their distances'''
     # Test with
@@ -167,7 +241,7 @@ def run_test_dist_check_trees(fun_dist_check, use_groups=False):
     imat[0, 1] = True
     imat[1, 2] = True
     imat[1, 3] = True
-    run_test_dist_check_tree(fun_dist_check, imat, use_groups)
+    run_test_dist_check_tree(fun_dist_check, imat, use_groups, batch)
 
     # Test with
     # 0 - 1 
@@ -177,7 +251,7 @@ def run_test_dist_check_trees(fun_dist_check, use_groups=False):
     imat[0, 1] = True
     imat[1, 2] = True
     imat[0, 3] = True
-    run_test_dist_check_tree(fun_dist_check, imat, use_groups)
+    run_test_dist_check_tree(fun_dist_check, imat, use_groups, batch)
 
     # Test with
     # 0 - 1 
@@ -186,13 +260,667 @@ def run_test_dist_check_trees(fun_dist_check, use_groups=False):
     imat = np.full((3,3), False)
     imat[0, 1] = True
     imat[1, 2] = True
-    run_test_dist_check_tree(fun_dist_check, imat, use_groups)
+    run_test_dist_check_tree(fun_dist_check, imat, use_groups, batch)
+
+
+def run_test_indexing_batch(n, perm, num_levels):
+    '''Assert that the vectorized indexing agrees with 
+        the scalar one'''
+    ix = PathIndexing(n, perm=perm, num_levels=num_levels)
+    inds = np.arange(ix.num_edges)
+    js, ks = ix.to_edges(inds)
+    assert [ix.to_edge(i) for i in inds] == list(zip(js, ks))
+    assert np.array_equal(ix.edges(js, ks), inds)
+    assert np.array_equal(ix.edges(ks, js), inds)
+    assert [ix.path(2, j, k) for j, k in zip(js, ks)] == \
+        list(ix.paths(2, js, ks))
+
+def run_test_dist_check_batch(use_groups=False):
+    '''Assert that the bit-sliced distance check finds the same
+        solutions as the scalar one'''
+    ns = [3, 4]
+    for n in ns:
+        ix = EdgeIndexing(n)
+        for i in range(2**ix.num_edges):
+            b = format(i, f'0{ix.num_edges}b')
+            dmat = dmat_expected(bits2imat(ix, b))
+            if use_groups:
+                dists = [dmat2ds_groups(dmat)]
+                if len(dists[0]) == 0:
+                    continue
+                sols = c_dist_check_groups_solutions(*dists)
+                fun = c_dist_check_groups
+            else:
+                dists = dmat2ds(dmat)
+                if len(dists[1]) == 0:
+                    continue
+                sols = c_dist_check_solutions(*dists)
+                fun = c_dist_check
+            sols_exp = [c for c in range(2**ix.num_edges) 
+                if fun(np.array(str2bools(
+                    format(c, f'0{ix.num_edges}b')[::-1])), *dists)]
+            assert sols == sols_exp
+
+def run_test_paths_random(num_graphs=200, seed=0):
+    '''Assert that c_paths agrees with c_paths_test1 on random graphs
+        with random permutations and numbers of levels'''
+    rng = np.random.default_rng(seed)
+    for _ in range(num_graphs):
+        n = int(rng.integers(2, 9))
+        ix = PathIndexing(n, perm=list(rng.permutation(n)), 
+            num_levels=int(rng.integers(1, n)))
+        edges = rng.random(ix.num_edges) < rng.random()
+        num_d_steps = int(rng.integers(0, n))
+        assert np.array_equal(c_paths(edges, ix, num_d_steps),
+            c_paths_test1(edges, ix, num_d_steps))
+
+def random_instances(rng, num_graphs, n=None, edge_prob=None, 
+        density=None):
+    '''Yield tuples (imat, dmat, ix, ds, ds_groups) for num_graphs 
+        random graphs drawn with the generator rng, where imat is 
+        the incidence matrix and dmat the distances with a random 
+        subset of the pairs known, skipping the graphs without known 
+        distances. The number of nodes n, the probability edge_prob
+        of each edge and the density of the known pairs are drawn 
+        at random when not given.'''
+    for _ in range(num_graphs):
+        num_nodes = int(rng.integers(3, 7)) if n is None else n
+        draws = rng.random((num_nodes, num_nodes))
+        imat = np.triu(draws < (rng.random() if edge_prob is None 
+            else edge_prob), 1)
+        imat = imat | imat.T
+        dmat = known_dmat(dmat_expected(imat), 
+            rng.random() if density is None else density, rng)
+        ix, ds = dmat2ds(dmat)
+        if len(ds) == 0:
+            continue
+        yield imat, dmat, ix, ds, dmat2ds_groups(dmat)
+
+def run_test_solver(num_graphs=30, seed=0):
+    '''Assert that the solver finds the same solutions as the 
+        bit-sliced distance checks on random graphs with random known
+        distances, with and without fixed edges'''
+    rng = np.random.default_rng(seed)
+    for _, _, ix, ds, ds_groups in random_instances(rng, num_graphs):
+        for fixed in [None, dist_check_fixed_edges(ix, ds)]:
+            out = solve_dist_check(ix, ds, fixed)
+            assert out['solutions'] == c_dist_check_solutions(ix, ds, 
+                fixed)
+            assert out['num_solutions'] == len(out['solutions'])
+        fixed = dist_check_groups_fixed_edges(ds_groups)
+        assert solve_dist_check_groups(ds_groups, fixed)['solutions'] \
+            == c_dist_check_groups_solutions(ds_groups, fixed)
+
+def unit_propagate(clauses, assignment):
+    '''Extend assignment, a dictionary from variables to Booleans, 
+        by unit propagation. Return False on a conflict.'''
+    changed = True
+    while changed:
+        changed = False
+        for clause in clauses:
+            if any(assignment.get(abs(l)) == (l > 0) for l in clause):
+                continue
+            unassigned = [l for l in clause if abs(l) not in assignment]
+            if len(unassigned) == 0:
+                return False
+            if len(unassigned) == 1:
+                assignment[abs(unassigned[0])] = unassigned[0] > 0
+                changed = True
+    return True
+
+def run_test_cnf(imat, pairs_known, use_groups=False):
+    '''Assert that the CNF export determines the path variables 
+        from the edges by unit propagation and is satisfied exactly 
+        by the edges passing the distance check'''
+    dmat = dmat_expected(imat)
+    known = np.full(dmat.shape, False)
+    for j, k in pairs_known:
+        known[j, k] = known[k, j] = True
+    dmat = np.where(known, dmat, np.inf)
+    if use_groups:
+        ds_groups = dmat2ds_groups(dmat)
+        ix = EdgeIndexing(len(dmat))
+        num_vars, clauses = dist_check_groups_cnf(ds_groups)
+        sols = c_dist_check_groups_solutions(ds_groups)
+    else:
+        ix, ds = dmat2ds(dmat)
+        num_vars, clauses = dist_check_cnf(ix, ds)
+        sols = c_dist_check_solutions(ix, ds)
+    for c in range(2**ix.num_edges):
+        assignment = {i + 1: bool(c >> i & 1) for i in range(ix.num_edges)}
+        assert unit_propagate(clauses, assignment) == (c in sols)
+
+def run_test_grover_search_many_sols(sols, n_state_qubits, 
+        num_seeds=200):
+    '''Assert that grover_search finds a solution when at least half
+        of the states are solutions, so that it runs 0 steps'''
+    assert grover_n_steps(n_state_qubits, len(sols)) == 0
+    for seed in range(num_seeds):
+        result = grover_search(grover_sampler(sols, n_state_qubits, 
+            seed), lambda c: c in sols, n_state_qubits, 
+            num_sols=len(sols))
+        assert result['solution'] in sols
+        assert result['oracle_calls'] == 0
+    result = grover_search(grover_sampler(sols, n_state_qubits, 0), 
+        lambda c: False, n_state_qubits, num_sols=len(sols), 
+        max_shots=5)
+    assert result['solution'] is None and result['shots'] == 5
+
+def run_test_grover_sim(sols, n_state_qubits, max_steps):
+    '''Assert that the simulated success probabilities of Grover's 
+        algorithm agree with the analytic ones'''
+    theta = np.arcsin(np.sqrt(len(sols)/2**n_state_qubits))
+    probs_exp = np.sin((2*np.arange(max_steps + 1) + 1)*theta)**2
+    probs = grover_success_probabilities(sols, n_state_qubits, max_steps)
+    assert np.allclose(probs, probs_exp)
+    for n_steps in range(max_steps + 1):
+        dist = grover_probabilities(sols, n_state_qubits, n_steps)
+        assert np.isclose(sum(dist.values()), 1)
+        assert np.isclose(sum(dist[format(c, f'0{n_state_qubits}b')] 
+            for c in sols), probs_exp[n_steps])
+
+def run_test_grover_circuits(max_steps, backend):
+    '''Assert that the circuits of GroverCircuits, transpiled for 
+        backend, have the amplitudes given by grover_amplitudes for
+        the solutions of the distance check on the edges, with the
+        workspace of the oracle returned to zero'''
+    # 1 - 0 - 2
+    imat = np.full((3,3), False)
+    imat[[0, 0], [1, 2]] = True
+    ix, ds = dmat2ds(dmat_expected(imat | imat.T))
+    sols = c_dist_check_solutions(ix, ds)
+    oracle = Bitflip2Phaseflip(Dist_check(ix, ds))
+    circuits = GroverCircuits(oracle, range(ix.num_edges))
+    for n_steps, qc in circuits.sweep(range(max_steps + 1), backend):
+        sv = Statevector(qc.remove_final_measurements(False)).data
+        amps = sv[:2**ix.num_edges]
+        amps_exp = grover_amplitudes(sols, ix.num_edges, n_steps)
+        # The diffuser of the circuits is minus that of grover_iteration
+        assert np.allclose(amps, (-1)**n_steps*amps_exp)
+
+def run_test_dist_check_fixed(use_groups=False):
+    '''Assert that fixing the edges determined by the distances 
+        does not change the solutions'''
+    ns = [3, 4]
+    for n in ns:
+        ix = EdgeIndexing(n)
+        for i in range(2**ix.num_edges):
+            b = format(i, f'0{ix.num_edges}b')
+            dmat = dmat_expected(bits2imat(ix, b))
+            if use_groups:
+                ds_groups = dmat2ds_groups(dmat)
+                if len(ds_groups) == 0:
+                    continue
+                fixed = dist_check_groups_fixed_edges(ds_groups)
+                sols = c_dist_check_groups_solutions(ds_groups)
+                sols_fixed = c_dist_check_groups_solutions(ds_groups, 
+                    fixed=fixed)
+            else:
+                ixp, ds = dmat2ds(dmat)
+                if len(ds) == 0:
+                    continue
+                fixed = dist_check_fixed_edges(ixp, ds)
+                sols = c_dist_check_solutions(ixp, ds)
+                sols_fixed = c_dist_check_solutions(ixp, ds, fixed=fixed)
+            num_unknown = ix.num_edges - len(fixed)
+            assert sols == [int(bools2str(expand_edges(str2bools(
+                format(c, f'0{num_unknown}b')[::-1]), fixed, 
+                ix.num_edges)[::-1]), 2) for c in sols_fixed]
+
+def run_test_q_dist_check_fixed():
+    '''Assert that Dist_check with fixed edges agrees with 
+        c_dist_check on all values of the remaining edges'''
+    # 0 - 1
+    #   / |
+    # 3 - 2
+    imat = np.full((4,4), False)
+    imat[[0, 1, 1, 2], [1, 2, 3, 3]] = True
+    imat = imat | imat.T
+    pairs_known = [(0, 2), (0, 3), (2, 3)]
+    ix, ds = dmat2ds(dmat_expected(imat))
+    ds = [(i, d) for i, d in ds if ix.to_edge(i) in pairs_known]
+    fixed = dist_check_fixed_edges(ix, ds)
+    qc = Dist_check(ix, ds, fixed)
+    num_unknown = ix.num_edges - len(fixed)
+    for i in range(2**num_unknown):
+        edges = str2bools(format(i, f'0{num_unknown}b'))
+        outb = run_circuit(qc, init_regs=[('edges', edges)])
+        assert_reg_is_zero(outb, qc, 'paths')
+        assert_reg_is_zero(outb, qc, 'ancs')
+        assert str2bools(outb)[-1] == c_dist_check(
+            expand_edges(edges, fixed, ix.num_edges), ix, ds)
 
+def run_test_table(num_edges, sols):
+    '''Assert that Table_check and Table_phase act on the basis 
+        states as expected'''
+    diag = np.ones(2**num_edges)
+    diag[sols] = -1
+    for method in ['mcz', 'diagonal']:
+        assert Operator(Table_phase(num_edges, sols, method)).equiv(
+            Operator(np.diag(diag)))
+    perm = np.zeros((2**(num_edges+1), 2**(num_edges+1)))
+    for c in range(2**num_edges):
+        for out in range(2):
+            flipped = out ^ (c in sols)
+            perm[c + (flipped << num_edges), c + (out << num_edges)] = 1
+    assert Operator(Table_check(num_edges, sols)).equiv(Operator(perm))
+
+def run_test_resources(n, density, seed=0):
+    '''Assert that the estimated resources agree with the counts 
+        in constructed circuits'''
+    rng = np.random.default_rng(seed)
+    for _, _, ix, ds, ds_groups in random_instances(rng, 1, n, 0.5, 
+            density):
+        for fixed, fixed_groups in [({}, {}), 
+                (dist_check_fixed_edges(ix, ds), 
+                dist_check_groups_fixed_edges(ds_groups))]:
+            res = dist_check_resources(ix, ds, fixed)
+            assert res.summary() == count_gates(
+                Dist_check(ix, ds, fixed)).summary()
+            assert dist_check_groups_resources(ds_groups, 
+                fixed_groups).summary() == count_gates(
+                Dist_check_groups(ds_groups, fixed_groups)).summary()
+            num_unknown = ix.num_edges - len(fixed)
+            if num_unknown >= 2:
+                qc = grover(Bitflip2Phaseflip(Dist_check(ix, ds, 
+                    fixed)), range(num_unknown), 2)
+                assert grover_resources(res, num_unknown, 
+                    2).summary() == count_gates(qc).summary()
+
+def run_test_reversible_batch(n, density, use_groups, num_cands=4096, 
+        seed=0, decompose=None):
+    '''Assert that the reversible simulation of the distance check 
+        agrees with the classical one on a random graph, given as 
+        the first candidate, and random candidates, and that 
+        the workspace is returned to zero'''
+    rng = np.random.default_rng(seed)
+    for imat, _, ix, ds, ds_groups in random_instances(rng, 1, n, 0.4, 
+            density):
+        cands = np.vstack([imat2edges(ix, imat)[None, :], 
+            rng.random((num_cands - 1, ix.num_edges)) < 0.5])
+        edges = pack_candidates(cands)
+        if use_groups:
+            qc = Dist_check_groups(ds_groups, decompose=decompose)
+            workspace = ['paths', 'ancs1', 'ancs2']
+            out_exp = c_dist_check_groups_batch(edges, ds_groups)
+        else:
+            qc = Dist_check(ix, ds, decompose=decompose)
+            workspace = ['paths', 'ancs']
+            out_exp = c_dist_check_batch(edges, ix, ds)
+        if qc.reg_size('tree') > 0:
+            workspace.append('tree')
+        state = simulate_reversible(qc, [('edges', edges)])
+        assert np.all(workspace_clean(qc, state, workspace) == ONES)
+        out = state[reg_indices(qc, 'out')[0]]
+        assert np.array_equal(out, out_exp)
+        assert out[0] & 1
+
+
+def run_test_optimize_groups(n, density, seed=0):
+    '''Assert that the optimized groupings check the same distances,
+        improve on dmat2ds_groups, respect the budget and agree with 
+        the counts in constructed circuits'''
+    rng = np.random.default_rng(seed)
+    for _, dmat, ix, ds, base_groups in random_instances(rng, 1, n, 0.5, 
+            density):
+        sols = c_dist_check_solutions(ix, ds)
+        check = lambda ds_groups: np.array_equal(
+            c_dist_check_groups_solutions(ds_groups), sols)
+        base = dist_check_groups_resources(base_groups)
+        ds_groups, res = optimize_groups(dmat)
+        assert res.toffolis <= base.toffolis
+        assert check(ds_groups)
+        assert count_gates(Dist_check_groups(ds_groups)).summary() == \
+            res.summary()
+        ds_groups, res = optimize_groups(dmat, objective='qubits')
+        assert check(ds_groups)
+        with pytest.raises(ValueError):
+            optimize_groups(dmat, max_qubits=res.qubits - 1)
+        ds_groups, res = optimize_groups(dmat, objective='gates',
+            max_gates=base.num_gates)
+        assert res.num_gates <= base.num_gates
+        assert check(ds_groups)
+
+def run_test_emit(decompose=None):
+    '''Assert that emitting Paths matches appending it as a gate on
+        the same qubits, and that emitting the inverse uncomputes it'''
+    paths = Paths(PathIndexing(4), 1, decompose=decompose)
+    qubits = list(reversed(range(paths.num_qubits)))
+    qc_gate = QCirc(paths.num_qubits)
+    qc_gate.append(paths.to_gate(), qubits)
+    qc = QCirc(paths.num_qubits)
+    emit(qc, paths, [qc.qubits[k] for k in qubits])
+    sv = Statevector.from_int(0b10110011011, 2**paths.num_qubits)
+    assert sv.evolve(qc).equiv(sv.evolve(qc_gate))
+    emit(qc, paths, [qc.qubits[k] for k in qubits], inverse=True)
+    assert sv.evolve(qc).equiv(sv)
+
+def run_test_circuit_cache(cache_dir):
+    '''Assert that CircuitCache evicts the least recently used circuits
+        to cache_dir and loads them back unchanged'''
+    imat = np.full((4,4), False)
+    imat[[0, 1, 1], [1, 2, 3]] = True
+    ds_groups = dmat2ds_groups(dmat_expected(imat | imat.T))
+    cache = CircuitCache(maxsize=2, cache_dir=str(cache_dir))
+    qc = cache.get(('test', 0), lambda: Dist_check_groups(ds_groups))
+    assert cache.get(('test', 0), None) is qc
+    cache.get(('test', 1), lambda: QCircH(QCirc(1)))
+    cache.get(('test', 2), lambda: QCircH(QCirc(1)))
+    assert ('test', 0) not in cache.circuits
+    qc_loaded = cache.get(('test', 0), None)
+    assert [(r.name, r.size) for r in qc_loaded.qregs] == \
+        [(r.name, r.size) for r in qc.qregs]
+    assert qc_loaded.decompose(reps=3).count_ops() == \
+        qc.decompose(reps=3).count_ops()
+
+def run_test_select_backend():
+    '''Assert that select_backend picks the simulation method needing
+        the least memory, raises MemoryError beyond the limit and
+        gives the same basis state runs as the default backend'''
+    # 0 - 1 - 2
+    imat = np.full((3,3), False)
+    imat[[0, 1], [1, 2]] = True
+    ix, ds = dmat2ds(dmat_expected(imat | imat.T))
+    oracle = Dist_check(ix, ds)
+    qc = grover(Bitflip2Phaseflip(oracle), range(ix.num_edges), 1)
+    assert estimate_memory(oracle)['num_superposed'] == 0
+    assert estimate_memory(qc)['num_superposed'] == ix.num_edges + 1
+    backend = select_backend(oracle)
+    assert backend.options.method == 'matrix_product_state'
+    qc_bell = qk.QuantumCircuit(2)
+    qc_bell.h(0)
+    qc_bell.cx(0, 1)
+    assert select_backend(qc_bell).options.method == 'stabilizer'
+    with pytest.raises(MemoryError):
+        select_backend(qc, memory_limit=1)
+    # basis state runs on the selected backend match the default one
+    init_regs_list = [[('edges', [1, 0, 1])], [('edges', [1, 1, 1])]]
+    outs = dict(run_basis_states(oracle, init_regs_list, backend))
+    assert outs == dict(run_basis_states(oracle, init_regs_list))
+
+def run_test_profiling(out_dir):
+    '''Assert that profiling records the phases of building and running
+        Grover's algorithm per group, saves them as JSON to out_dir,
+        and records nothing once disabled'''
+    imat = np.full((4,4), False)
+    imat[[0, 1, 1], [1, 2, 3]] = True
+    ds_groups = dmat2ds_groups(dmat_expected(imat | imat.T))
+    with profiling() as prof:
+        prof.clear()
+        circuit_cache.clear()
+        oracle = dist_check_groups_circuit(ds_groups)
+        circuits = GroverCircuits(Bitflip2Phaseflip(oracle), 
+            range(oracle.find_reg('edges').size))
+        backend = qiskit_aer.AerSimulator(method='statevector')
+        list(run_circuits([circuits.circuit(1, backend)], 10, backend))
+    assert not prof.enabled
+    groups = [r for r in prof.records if r['phase'] == 'group']
+    assert [r['group'] for r in groups] == list(range(len(ds_groups)))
+    assert all(r['num_qubits'] > 0 and r['wall_time'] >= 0 
+        for r in groups)
+    summary = prof.summary()
+    for phase in ['build', 'emit', 'transpile', 'compose', 'simulate']:
+        assert summary[phase]['count'] > 0
+    prof.to_json(out_dir / 'profile.json')
+    with open(out_dir / 'profile.json') as f:
+        assert json.load(f) == json.loads(prof.to_json())
+    # Disabled profilers record nothing
+    prof.clear()
+    circuit_cache.clear()
+    dist_check_groups_circuit(ds_groups)
+    assert prof.records == []
+
+def run_test_benchmark(out_dir):
+    '''Assert that the benchmarks cover the requested cases, that
+        compare flags the regressions beyond the tolerance only, and
+        that the command line saves and compares baselines in out_dir'''
+    baseline = benchmark.run_benchmarks(ns=[4], densities=[1.0], 
+        instances=['A', 'B'], repeat=1)
+    assert set(baseline['results']) == {
+        'oracle/n=4/density=1.0/grouped=False',
+        'oracle/n=4/density=1.0/grouped=True',
+        'grover/A/fixed=True', 'grover/B/fixed=True'}
+    assert benchmark.compare(baseline, baseline) == []
+    current = json.loads(json.dumps(baseline))
+    result = current['results']['oracle/n=4/density=1.0/grouped=False']
+    result['depth'] += 1
+    result['build_time'] *= 1.2
+    result['candidates_per_second'] /= 2
+    assert [(r['case'], r['metric']) 
+        for r in benchmark.compare(baseline, current)] == [
+        ('oracle/n=4/density=1.0/grouped=False', 'depth'),
+        ('oracle/n=4/density=1.0/grouped=False', 'candidates_per_second')]
+    path = str(out_dir / 'baseline.json')
+    assert benchmark.main(['--ns', '4', '--densities', '1.0', 
+        '--instances', 'A', '--repeat', '1', '--save', path]) == 0
+    assert benchmark.main(['--ns', '4', '--densities', '1.0', 
+        '--instances', 'A', '--repeat', '1', '--compare', path, 
+        '--tolerance', '100']) == 0
+
+def run_test_runner(out_dir):
+    '''Assert that the runner writes one result per instance, resumes
+        an interrupted output file, handles instances without unknown
+        edges and reports timeouts, with the files in out_dir'''
+    instances = [
+        {'id': 'A', 'num_nodes': 3, 'edges': [[0, 2], [1, 2]], 
+            'pairs_known': [[0, 1]]},
+        {'id': 'B', 'num_nodes': 4, 'edges': [[0, 3], [1, 2], [1, 3], 
+            [2, 3]], 'pairs_known': [[0, 1], [0, 2], [1, 2]]},
+        {'id': 'none', 'num_nodes': 3, 'edges': [], 'pairs_known': []},
+        {'dmat': [[0, 1, None], [1, 0, 1], [None, 1, 0]]},
+        {'id': 'fixed', 'num_nodes': 3, 'edges': [[0, 1], [1, 2]]}]
+    path = str(out_dir / 'instances.jsonl')
+    with open(path, 'w') as f:
+        f.writelines(json.dumps(instance) + '\n' for instance in instances)
+    out_path = str(out_dir / 'results.jsonl')
+    # An interrupted run has written A and the start of B
+    with open(out_path, 'w') as f:
+        f.write(json.dumps({'id': 'A', 'status': 'ok'}) + '\n{"id": "B"')
+    assert runner.main([path, out_path, '--workers', '2', '--strategy', 
+        'aer', '--seed', '0']) == 0
+    with open(out_path) as f:
+        lines = f.readlines()
+    # The start of B is dropped
+    results = {r['id']: r for r in map(json.loads, lines)}
+    assert len(lines) == len(results) == 5
+    assert set(results) == {'A', 'B', 'none', 3, 'fixed'}
+    assert results['B']['most_frequent'] == '001111'
+    assert results['B']['success_probability'] > 0.5
+    assert results['none']['status'] == 'error'
+    assert results[3]['most_frequent_is_solution']
+    # All edges are fixed by the distances
+    assert results['fixed']['n_state_qubits'] == 0
+    assert results['fixed']['success_probability'] == 1
+    assert list(runner.run_batch(instances, out_path)) == []
+    result = runner.run_instance(instances[1], strategy='amplitude')
+    assert np.isclose(result['success_probability'], 
+        result['solution_probability'])
+    # Without fixed edges B runs 6 steps on 11 qubits
+    results = list(runner.run_batch(instances[1:2], 
+        str(out_dir / 'timeout.jsonl'), timeout=0.01, strategy='aer',
+        fix_edges=False))
+    assert results[0]['status'] == 'timeout'
+
+def run_test_cnf_tree(out_dir):
+    '''Assert that the CNF export agrees with the distance check for
+        a tree with some of its distances known, and that the DIMACS
+        file written to out_dir holds the clauses'''
+    # 0 - 1 - 2
+    #     |
+    #     3
+    imat = np.full((4,4), False)
+    imat[[0, 1, 1], [1, 2, 3]] = True
+    imat = imat | imat.T
+    for pairs_known in [[(0, 2)], [(0, 2), (0, 3), (2, 3)]]:
+        run_test_cnf(imat, pairs_known)
+        run_test_cnf(imat, pairs_known, use_groups=True)
+    ix, ds = dmat2ds(dmat_expected(imat))
+    num_vars, clauses = dist_check_cnf(ix, ds, 
+        dist_check_fixed_edges(ix, ds))
+    text = to_dimacs(num_vars, clauses, out_dir / 'check.cnf')
+    assert text.split('\n')[0] == f'p cnf {num_vars} {len(clauses)}'
+    assert (out_dir / 'check.cnf').read_text() == text
+
+def run_test_grover_search(sols, n):
+    '''Assert that grover_search finds one of the solutions sols
+        of n bits with simulated samplers, also after estimating
+        their number, and reports none if there are none, and that
+        it finds a solution with a circuit sampler'''
+    verify = lambda c: c in sols
+    for seed in range(10):
+        result = grover_search(grover_sampler(sols, n, seed), verify, n, 
+            seed=seed)
+        assert result['solution'] in sols
+        assert result['shots'] >= 1
+    estimate = estimate_num_solutions(grover_sampler(sols, n, 0), 
+        verify, n)
+    assert estimate['num_sols'] == len(sols)
+    result = grover_search(grover_sampler(sols, n, 0), verify, n, 
+        num_sols=estimate['num_sols'])
+    assert result['solution'] in sols
+    assert result['oracle_calls'] % grover_n_steps(n, len(sols)) == 0
+    result = grover_search(grover_sampler([], n, 0), verify, n)
+    assert result['solution'] is None
+    # 0 - 1 - 2 with the distance between 0 and 2 known
+    imat = np.full((3,3), False)
+    imat[[0, 1], [1, 2]] = True
+    ix, ds = dmat2ds(dmat_expected(imat | imat.T))
+    ds = [(i, d) for i, d in ds if i == ix.edge(0, 2)]
+    dist_sols = c_dist_check_solutions(ix, ds)
+    circuits = GroverCircuits(Bitflip2Phaseflip(Dist_check(ix, ds)), 
+        range(ix.num_edges))
+    backend = qiskit_aer.AerSimulator(method='statevector')
+    result = grover_search(circuits_sampler(circuits, backend, 0), 
+        lambda c: c in dist_sols, ix.num_edges, seed=0)
+    assert result['solution'] in dist_sols
+
+def run_test_graph_inputs(n, seed=0):
+    '''Assert that dense, sparse and edge list graphs and distance
+        matrices of n nodes give the same edges and distances, also
+        when the distances are iterated over in chunks'''
+    rng = np.random.default_rng(seed)
+    imat = np.triu(rng.random((n, n)) < 0.3, 1)
+    edge_list = list(zip(*np.nonzero(imat)))
+    imat = imat | imat.T
+    ix = PathIndexing(n, perm=rng.permutation(n))
+    edges = [imat[ix.to_edge(i)] for i in range(ix.num_edges)]
+    for graph in [imat, spr.csr_matrix(imat), edge_list]:
+        assert np.array_equal(imat2edges(ix, graph), edges)
+    dmat = dmat_expected(imat)
+    assert np.array_equal(dmat_expected(edge_list, n), dmat)
+    dmat = known_dmat(dmat, 0.5, rng)
+    ix, ds = dmat2ds(dmat)
+    assert ds == [(i, int(dmat[ix.to_edge(i)])) 
+        for i in range(ix.num_edges) if dmat[ix.to_edge(i)] != np.inf]
+    # Sparse distance matrices store only the known distances
+    dmat_sparse = spr.coo_matrix(np.triu(np.where(dmat == np.inf, 0, dmat)))
+    assert dmat2ds(dmat_sparse)[1] == ds
+    assert list(iter_ds(dmat, chunk_rows=2)) == ds
+    assert [(ix.perm, ds) for ix, ds in dmat2ds_groups(dmat_sparse.T)] == \
+        [(ix.perm, ds) for ix, ds in dmat2ds_groups(dmat)]
+    _, ds = dmat2ds(dmat_expected(imat))
+    assert list(iter_expected_ds(edge_list, n, chunk_rows=4)) == ds
+
+def run_test_paths_cone():
+    '''Assert that paths_cone keeps every path needed by Test 2 and
+        the paths feeding it through Test 1, and drops some others'''
+    ix = PathIndexing(6)
+    ds = [(ix.edge(0, 3), 4), (ix.edge(2, 5), 3), (ix.edge(1, 4), 1)]
+    needed = paths_cone(ix, ds, 3)
+    flags = dist_check_test2_flags(ix, ds)
+    assert np.all(needed[flags[1:] != 0])
+    for d, i in zip(*np.nonzero(needed[1:])):
+        pairs, single, _ = paths_test1_vars(np.full(ix.num_edges, True), 
+            needed.flatten(), ix, d + 1, i)
+        assert single and all(prev for prev, _ in pairs)
+    assert needed.sum() < needed.size
+
+def run_test_table_grover(n_steps):
+    '''Assert that Grover's algorithm with the phase oracle from
+        table_dist_check has the probabilities of grover_probabilities
+        after n_steps steps'''
+    # 0 - 1 - 2
+    imat = np.full((3,3), False)
+    imat[[0, 1], [1, 2]] = True
+    ix, ds = dmat2ds(dmat_expected(imat | imat.T))
+    ds = [(i, d) for i, d in ds if i == ix.edge(0, 2)]
+    oracle = table_dist_check(ix, ds, phase=True)
+    qc = grover(oracle, range(ix.num_edges), n_steps)
+    probs = Statevector(qc.remove_final_measurements(False)
+        ).probabilities_dict()
+    probs_exp = grover_probabilities(c_dist_check_solutions(ix, ds), 
+        ix.num_edges, n_steps)
+    assert probs.keys() == probs_exp.keys()
+    assert np.allclose([probs[k] for k in probs_exp], 
+        list(probs_exp.values()))
+
+def run_test_decompose_phases():
+    '''Assert that the decompositions of the wide gates give the same
+        phase oracle as the library gates, with the workspace
+        returned to zero'''
+    # 0 - 1 - 2
+    #     |
+    #     3
+    imat = np.full((4,4), False)
+    imat[[0, 1, 1], [1, 2, 3]] = True
+    dmat = dmat_expected(imat | imat.T)
+    ix, ds = dmat2ds(dmat)
+    ds_groups = dmat2ds_groups(dmat)
+    for build in [lambda decompose: Dist_check(ix, ds, decompose=decompose),
+            lambda decompose: Dist_check_groups(ds_groups, 
+                decompose=decompose)]:
+        svs = []
+        for decompose in [None, 'qubits', 'depth']:
+            oracle = build(decompose)
+            qc = QCirc(oracle.num_qubits)
+            qc.h(range(oracle.find_reg('edges').size))
+            qc.compose(Bitflip2Phaseflip(oracle), inplace=True)
+            sv = Statevector(qc).data
+            # The workspace is zero so only the edges carry amplitude
+            svs.append(sv[:2**ix.num_edges])
+            assert np.isclose(np.linalg.norm(svs[-1]), 1)
+        assert np.allclose(svs[0], svs[1]) and np.allclose(svs[0], svs[2])
+
+def run_test_basis_states(backend=None, chunk_size=64, max_workers=1):
+    '''Assert that the batched runs of Dist_check on all values of
+        the edges agree with c_dist_check, when run on backend in
+        jobs of chunk_size circuits over max_workers processes'''
+    # 0 - 1 - 2
+    imat = np.full((3,3), False)
+    imat[[0, 1], [1, 2]] = True
+    ix, ds = dmat2ds(dmat_expected(imat | imat.T))
+    edges_list = [str2bools(format(i, f'0{ix.num_edges}b'))
+        for i in range(2**ix.num_edges)]
+    outs = qb_outputs(Dist_check(ix, ds), edges_list, ['paths', 'ancs'],
+        backend=backend, chunk_size=chunk_size, max_workers=max_workers)
+    assert outs == [c_dist_check(edges, ix, ds) for edges in edges_list]
+
+def run_test_basis_states_layout():
+    '''Assert that basis state runs keep the qubits in place on a
+        backend with a coupling map, and are rejected when routing
+        permutes the qubits'''
+    # The default layout of this backend moves the qubits
+    run_test_basis_states(GenericBackendV2(7, noise_info=False, seed=0))
+    backend = GenericBackendV2(7, noise_info=False, seed=0,
+        coupling_map=[[k, k + 1] for k in range(6)])
+    with pytest.raises(ValueError):
+        run_test_basis_states(backend)
 
 # Pytest will collect and run the following functions:
 
+def test_indexing_batch():
+    run_test_indexing_batch(7, None, None)
+    run_test_indexing_batch(7, 3, 1)
+    run_test_indexing_batch(7, [4, 0, 6, 2, 1, 5, 3], 2)
+def test_graph_inputs():
+    run_test_graph_inputs(9)
+
 def test_c_dists():
     run_test_dists(c_paths)
+def test_c_dists_test1():
+    run_test_dists(c_paths_test1)
+def test_c_paths_random():
+    run_test_paths_random()
 def test_c_dist_check_self():
     run_test_dist_check_self(c_dist_check)
 def test_c_dist_check_groups_self():
@@ -201,6 +929,97 @@ def test_c_dist_check_trees():
     run_test_dist_check_trees(c_dist_check)
 def test_c_dist_check_groups_trees():
     run_test_dist_check_trees(c_dist_check_groups, use_groups=True)
+def test_c_dist_check_batch():
+    run_test_dist_check_batch()
+def test_c_dist_check_groups_batch():
+    run_test_dist_check_batch(use_groups=True)
+
+
+def test_solver():
+    run_test_solver()
+
+def test_cnf(tmp_path):
+    run_test_cnf_tree(tmp_path)
+
+def test_c_dist_check_fixed():
+    run_test_dist_check_fixed()
+def test_c_dist_check_groups_fixed():
+    run_test_dist_check_fixed(use_groups=True)
+def test_circuit_cache(tmp_path):
+    run_test_circuit_cache(tmp_path)
+def test_profiling(tmp_path):
+    run_test_profiling(tmp_path)
+
+def test_benchmark(tmp_path):
+    run_test_benchmark(tmp_path)
+
+def test_runner(tmp_path):
+    run_test_runner(tmp_path)
+
+def test_grover_sim():
+    run_test_grover_sim([5], 3, 4)
+    run_test_grover_sim([3, 17, 40], 7, 10)
+
+def test_grover_search_many_sols():
+    run_test_grover_search_many_sols([0, 1, 2], 2)
+    run_test_grover_search_many_sols(list(range(8)), 4)
+
+def test_grover_circuits():
+    run_test_grover_circuits(3, qiskit_aer.AerSimulator())
+def test_grover_circuits_layout():
+    run_test_grover_circuits(3, GenericBackendV2(7, noise_info=False, 
+        seed=0))
+
+def test_grover_search():
+    run_test_grover_search([3, 17, 40, 200], 8)
+
+def test_resources():
+    for seed in range(3):
+        run_test_resources(4, 0.5, seed)
+        run_test_resources(5, 1.0, seed)
+
+def test_optimize_groups():
+    for seed in range(3):
+        run_test_optimize_groups(6, 0.6, seed)
+
+def test_paths_cone():
+    run_test_paths_cone()
+
+def test_table():
+    run_test_table(0, [0])
+    run_test_table(1, [])
+    run_test_table(3, [0, 5, 6])
+    run_test_table(4, [1, 2, 3, 15])
+
+def test_table_grover():
+    run_test_table_grover(2)
+
+def test_r_dists():
+    run_test_dists(r_paths)
+def test_r_dist_check_trees():
+    run_test_dist_check_trees(r_dist_check)
+def test_r_dist_check_groups_trees():
+    run_test_dist_check_trees(r_dist_check_groups, use_groups=True)
+def test_r_dist_check_batch():
+    for n in range(5, 9):
+        run_test_reversible_batch(n, 0.5, False, seed=n)
+        run_test_reversible_batch(n, 1.0, False, seed=n)
+def test_r_dist_check_groups_batch():
+    for n in range(5, 9):
+        run_test_reversible_batch(n, 0.5, True, seed=n)
+        run_test_reversible_batch(n, 1.0, True, seed=n)
+def test_r_dist_check_decompose():
+    for decompose in ['qubits', 'depth']:
+        for n in range(5, 8):
+            run_test_reversible_batch(n, 0.5, False, seed=n, 
+                decompose=decompose)
+            run_test_reversible_batch(n, 0.5, True, seed=n, 
+                decompose=decompose)
+def test_decompose_phases():
+    run_test_decompose_phases()
+def test_emit():
+    for decompose in [None, 'qubits']:
+        run_test_emit(decompose)
 
 def test_q_dists():
     run_test_dists(q_paths)
@@ -208,3 +1027,16 @@ def test_q_dist_check_trees():
     run_test_dist_check_trees(q_dist_check)
 def test_q_dist_check_groups_trees():
     run_test_dist_check_trees(q_dist_check_groups, use_groups=True)
+def test_qb_dist_check_trees():
+    run_test_dist_check_trees(qb_dist_check, batch=True)
+def test_qb_dist_check_groups_trees():
+    run_test_dist_check_trees(qb_dist_check_groups, use_groups=True, 
+        batch=True)
+def test_qb_dist_check_parallel():
+    run_test_basis_states(chunk_size=2, max_workers=2)
+def test_qb_dist_check_layout():
+    run_test_basis_states_layout()
+def test_q_dist_check_fixed():
+    run_test_q_dist_check_fixed()
+def test_select_backend():
+    run_test_select_backend()